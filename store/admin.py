@@ -2,7 +2,8 @@ from django.contrib import admin, messages
 from django.db.models import Count, QuerySet
 from django.urls import reverse
 from django.utils.html import format_html, urlencode
-from . import models
+from . import export, models, promotions
+from .cache import invalidate
 
 
 class InventoryFilter(admin.SimpleListFilter):
@@ -39,10 +40,37 @@ class CollectionAdmin(admin.ModelAdmin):
             products_count=Count('product')
         )
     
+class PromotionTargetInline(admin.TabularInline):
+    autocomplete_fields = ['collection', 'tag']
+    model = models.PromotionTarget
+    extra = 0
+
+
 @admin.register(models.Promotion)   
 class PromotionAdmin(admin.ModelAdmin):
-    list_display = ('description', 'discount_products_link')
+    list_display = ('description', 'discount_products_link', 'status', 'starts_at', 'ends_at')
+    list_filter = ['status']
     search_fields = ['discount']
+    inlines = [PromotionTargetInline]
+    actions = ['apply_now', 'expire_now']
+
+    @admin.action(description='Apply to targeted products now')
+    def apply_now(self, request, queryset):
+        updated_count = sum(promotions.apply_promotion(promotion) for promotion in queryset)
+        self.message_user(
+            request,
+            f'{updated_count} products were successfully updated. ',
+            messages.SUCCESS
+        )
+
+    @admin.action(description='Expire now')
+    def expire_now(self, request, queryset):
+        updated_count = sum(promotions.expire_promotion(promotion) for promotion in queryset)
+        self.message_user(
+            request,
+            f'{updated_count} products were successfully updated. ',
+            messages.SUCCESS
+        )
 
     @admin.display(description="Discounted Products")
     def discount_products_link(self, promotion):
@@ -64,12 +92,12 @@ class PromotionAdmin(admin.ModelAdmin):
 
 @admin.register(models.Product)
 class ProductAdmin(admin.ModelAdmin):
-    search_fields = ['title']
+    search_fields = ['title', 'sku']
     autocomplete_fields = ['collection']
     prepopulated_fields = {
         'slug': ['title']
     }
-    actions = ['clear_inventory']
+    actions = ['clear_inventory', 'export_csv', 'export_jsonl']
     list_display = ['id', 'image', 'title', 'price','brand', 'model', 'color', 'rating', 'inventory_status', 'collection_title', 'on_sale', 'product_discount', 'price_after_discount']  
     list_editable = ['price']
     list_filter = ['collection', 'promotion__discount', 'last_update', InventoryFilter]
@@ -82,13 +110,13 @@ class ProductAdmin(admin.ModelAdmin):
     def product_discount(self, product):
         return f"{product.promotion.discount}%" if product.promotion else "No Discount"
     
-    @admin.display(description="Price After Discount")
+    @admin.display(description="Price After Discount", ordering='effective_price')
     def price_after_discount(self, product):
         return f"${product.price_after_discount}"
     
-    @admin.display(description="On Sale")
+    @admin.display(description="On Sale", boolean=True)
     def on_sale(self, product):
-        return (product.promotion and product.promotion.discount > 0 )
+        return product.on_sale
 
     @admin.display(ordering='inventory')
     def inventory_status(self, product):
@@ -99,12 +127,21 @@ class ProductAdmin(admin.ModelAdmin):
     @admin.action(description='Clear inventory')
     def clear_inventory(self, request, queryset):
         updated_count = queryset.update(inventory = 0)
+        invalidate('catalog')
         self.message_user(
             request,
             f'{updated_count} products were successfully updated. ',
             messages.SUCCESS
         )
 
+    @admin.action(description='Export selected products (CSV)')
+    def export_csv(self, request, queryset):
+        return export.streaming_response('products', queryset, 'csv')
+
+    @admin.action(description='Export selected products (JSONL)')
+    def export_jsonl(self, request, queryset):
+        return export.streaming_response('products', queryset, 'jsonl')
+
 @admin.register(models.Customer)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ['first_name', 'last_name', 'membership', 'customer_orders']
@@ -143,9 +180,15 @@ class OrderAdmin(admin.ModelAdmin):
     list_select_related = ['customer']
     inlines = [OrderItemInline]
     list_per_page = 10
+    actions = ['export_csv', 'export_jsonl']
 
     def customer_name(self, order):
         return order.customer.first_name + ' ' + order.customer.last_name
-    
 
-    
\ No newline at end of file
+    @admin.action(description='Export selected orders (CSV)')
+    def export_csv(self, request, queryset):
+        return export.streaming_response('orders', queryset, 'csv')
+
+    @admin.action(description='Export selected orders (JSONL)')
+    def export_jsonl(self, request, queryset):
+        return export.streaming_response('orders', queryset, 'jsonl')
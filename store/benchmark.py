@@ -0,0 +1,426 @@
+"""
+Benchmark harness: a synthetic catalog and a mixed browse / search / cart /
+checkout workload replayed against the GraphQL schema, either in-process
+or over HTTP. Reports latency percentiles, SQL queries per operation and
+throughput, and compares them to a stored baseline (see the seed_catalog
+and benchmark commands).
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+from django.middleware.csrf import CSRF_SECRET_LENGTH
+from django.utils.crypto import get_random_string
+from tags.models import Tag, TaggedItem
+from . import querystats
+from .models import Cart, CartItem, Collection, Customer, Product, Promotion, discounted_price
+from .pagination import MAX_PAGE_SIZE
+from .search import rebuild_index
+
+DEFAULT_SCALE = {
+    'products': 100_000,
+    'collections': 200,
+    'promotions': 20,
+    'tags': 500,
+    'customers': 1000,
+    'carts': 1000,
+}
+SKU_PREFIX = 'BENCH-'
+BRANDS = ['Acme', 'Globex', 'Initech', 'Umbrella', 'Stark', 'Wayne', 'Hooli', 'Soylent']
+COLORS = ['black', 'white', 'red', 'blue', 'green', 'silver', 'gold']
+WORDS = ['phone', 'laptop', 'camera', 'speaker', 'watch', 'tablet', 'monitor', 'keyboard', 'charger', 'headset']
+TAGS_PER_PRODUCT = 2
+
+# A p95 slower than the baseline by both margins counts as a regression
+DEFAULT_TOLERANCE = 0.5
+MIN_SLOWDOWN = 0.005
+
+
+def seed(scale=None, batch_size=5000, seed=0, on_progress=None):
+    """
+    Bulk insert a synthetic catalog. Bypasses save() and signals, so
+    effective prices and the search index are filled in here.
+    """
+    scale = {**DEFAULT_SCALE, **(scale or {})}
+    rng = random.Random(seed)
+
+    collections = Collection.objects.bulk_create(
+        Collection(title=f'{WORDS[i % len(WORDS)].title()}s {i}') for i in range(scale['collections'])
+    )
+    collection_ids = list(Collection.objects.order_by('-id').values_list('id', flat=True)[:len(collections)])
+    promotions = Promotion.objects.bulk_create(
+        Promotion(description=f'Benchmark {5 + i % 10 * 5}%', discount=5 + i % 10 * 5)
+        for i in range(scale['promotions'])
+    )
+    discounts = dict(Promotion.objects.order_by('-id').values_list('id', 'discount')[:len(promotions)])
+    promotion_ids = list(discounts)
+
+    def products(start, stop):
+        for i in range(start, stop):
+            word = WORDS[i % len(WORDS)]
+            brand = rng.choice(BRANDS)
+            price = Decimal(rng.randrange(500, 500000)) / 100
+            promotion_id = rng.choice(promotion_ids) if promotion_ids and rng.random() < 0.2 else None
+            discount = discounts[promotion_id] if promotion_id else 0
+            yield Product(
+                sku=f'{SKU_PREFIX}{i:07}',
+                title=f'{brand} {word} {i}',
+                slug=f'{brand}-{word}-{i}'.lower(),
+                brand=brand,
+                model=f'{word[:3].upper()}-{i % 100}',
+                color=rng.choice(COLORS),
+                description=f'A {rng.choice(COLORS)} {word} from {brand}.',
+                price=price,
+                effective_price=discounted_price(price, discount),
+                on_sale=discount > 0,
+                inventory=1000,
+                rating=round(rng.uniform(1, 5), 1),
+                collection_id=rng.choice(collection_ids),
+                promotion_id=promotion_id,
+            )
+
+    for start in range(0, scale['products'], batch_size):
+        Product.objects.bulk_create(products(start, min(start + batch_size, scale['products'])))
+        if on_progress:
+            on_progress(f'{min(start + batch_size, scale["products"])} products')
+
+    product_ids = list(
+        Product.objects.filter(sku__startswith=SKU_PREFIX).order_by('id').values_list('id', flat=True)
+    )
+    Tag.objects.bulk_create(
+        (Tag(label=f'bench-{i}') for i in range(scale['tags'])), ignore_conflicts=True,
+    )
+    tag_ids = list(Tag.objects.filter(label__startswith='bench-').values_list('id', flat=True))
+    content_type = ContentType.objects.get_for_model(Product)
+    if tag_ids:
+        for start in range(0, len(product_ids), batch_size):
+            TaggedItem.objects.bulk_create(
+                TaggedItem(tag_id=tag_id, content_type=content_type, object_id=product_id)
+                for product_id in product_ids[start:start + batch_size]
+                for tag_id in rng.sample(tag_ids, min(TAGS_PER_PRODUCT, len(tag_ids)))
+            )
+        if on_progress:
+            on_progress(f'{len(product_ids) * TAGS_PER_PRODUCT} tags')
+
+    Customer.objects.bulk_create(
+        Customer(first_name='Bench', last_name=str(i), email=f'bench-{i}@example.com', phone='0')
+        for i in range(scale['customers'])
+    )
+    Cart.objects.bulk_create(Cart() for _ in range(scale['carts']))
+    cart_ids = list(Cart.objects.order_by('-id').values_list('id', flat=True)[:scale['carts']])
+    if product_ids:
+        CartItem.objects.bulk_create(
+            CartItem(cart_id=cart_id, product_id=product_id, quantity=rng.randint(1, 3))
+            for cart_id in cart_ids
+            for product_id in rng.sample(product_ids, 3)
+        )
+
+    if on_progress:
+        on_progress('search index')
+    rebuild_index(batch_size)
+
+
+GET_PRODUCTS = '''
+query BrowseProducts($first: Int!, $after: String, $sort: ProductSort!) {
+  getProductsConnection(first: $first, after: $after, sort: $sort) {
+    edges { node { id title priceAfterDiscount onSale collection { title } tags { label } } }
+    pageInfo { hasNextPage endCursor }
+  }
+}'''
+# Unpaginated list; select_related keeps it to one query
+GET_ALL_PRODUCTS = '''
+query AllProducts($limit: Int!) {
+  getProducts(limit: $limit) { id title priceAfterDiscount collection { title } promotion { discount } }
+}'''
+GET_COLLECTION_PRODUCTS = '''
+query BrowseCollection($title: String!) {
+  getCollectionProductsConnection(title: $title, first: 20) {
+    edges { node { id title priceAfterDiscount } }
+    pageInfo { hasNextPage endCursor }
+  }
+}'''
+GET_PRODUCT = '''
+query ProductDetail($id: Int!) {
+  getProduct(id: $id) {
+    id title description brand model color price priceAfterDiscount inventory rating
+    collection { title } promotion { discount } tags { label }
+  }
+}'''
+PRODUCTS_BY_TAGS = '''
+query BrowseTags($labels: [String!]!) {
+  productsByTags(labels: $labels, first: 20) { edges { node { id title priceAfterDiscount } } }
+}'''
+SEARCH_PRODUCTS = '''
+query Search($query: String!) {
+  searchProducts(query: $query, limit: 20) { id title priceAfterDiscount collection { title } }
+}'''
+FILTER_PRODUCTS = '''
+query Filter($brands: [String!], $colors: [String!]) {
+  filterProducts(filters: {brands: $brands, colors: $colors}, first: 20) {
+    products { edges { node { id title priceAfterDiscount } } }
+    facets { name values { value count } }
+  }
+}'''
+GET_CART = '''
+query Cart($id: Int!) {
+  getCart(id: $id) { id totalPrice items { productName productPrice quantity subtotal } }
+}'''
+SET_CART_ITEMS = '''
+mutation SetCartItems($cartId: Int!, $items: [CartItemInput!]!) {
+  setCartItems(cartId: $cartId, items: $items) { id totalPrice }
+}'''
+ADD_TO_CART = '''
+mutation AddToCart($cartId: Int!, $productId: Int!) {
+  addToCart(cartId: $cartId, itemData: {productId: $productId, quantity: 1}) { id totalPrice }
+}'''
+CREATE_CART = 'mutation CreateCart { createCart { id } }'
+ADD_ITEMS_TO_CART = '''
+mutation AddItemsToCart($cartId: Int!, $items: [CartItemInput!]!) {
+  addItemsToCart(cartId: $cartId, items: $items) { id totalPrice }
+}'''
+CHECKOUT = '''
+mutation Checkout($cartId: Int!, $customerId: Int!) {
+  checkout(cartId: $cartId, customerId: $customerId) { id items { quantity unitPrice } }
+}'''
+
+
+class Workload:
+    """
+    Weighted browse / search / cart / checkout sessions over the seeded
+    catalog. Each session runs one or more operations through `execute`.
+    """
+
+    MIX = {'browse': 60, 'search': 25, 'cart': 10, 'checkout': 5}
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        products = Product.objects.order_by()
+        self.product_ids = list(products.values_list('id', flat=True))
+        if not self.product_ids:
+            raise ValueError('The catalog is empty; run seed_catalog first')
+        self.collections = list(Collection.objects.values_list('title', flat=True))
+        self.tags = list(
+            Tag.objects.filter(pk__in=TaggedItem.objects.values('tag_id')).values_list('label', flat=True)
+        )
+        self.cart_ids = list(Cart.objects.filter(items__isnull=False).distinct().values_list('id', flat=True))
+        self.customer_ids = list(Customer.objects.values_list('id', flat=True))
+        self.brands = list(products.exclude(brand=None).values_list('brand', flat=True).distinct())
+        self.colors = list(products.exclude(color=None).values_list('color', flat=True).distinct())
+
+    def sessions(self, count, seed_offset=0):
+        rng = random.Random(f'{self.seed}:{seed_offset}')
+        kinds = [kind for kind, weight in self.MIX.items() for _ in range(weight)]
+        for _ in range(count):
+            kind = rng.choice(kinds)
+            yield kind, random.Random(rng.random())
+
+    def run(self, kind, rng, execute):
+        getattr(self, kind)(rng, execute)
+
+    def items(self, rng, count=2):
+        return [
+            {'productId': product_id, 'quantity': rng.randint(1, 3)}
+            for product_id in rng.sample(self.product_ids, min(count, len(self.product_ids)))
+        ]
+
+    def browse(self, rng, execute):
+        sort = rng.choice(['TITLE', 'PRICE'])
+        data = execute('BrowseProducts', GET_PRODUCTS, {'first': 20, 'after': None, 'sort': sort})
+        page = (data or {}).get('getProductsConnection') or {}
+        if (page.get('pageInfo') or {}).get('hasNextPage'):
+            execute('BrowseProducts', GET_PRODUCTS, {'first': 20, 'after': page['pageInfo']['endCursor'], 'sort': sort})
+        # Varied so that not every call is a catalog cache hit
+        execute('AllProducts', GET_ALL_PRODUCTS, {'limit': rng.randint(1, MAX_PAGE_SIZE)})
+        if self.collections:
+            execute('BrowseCollection', GET_COLLECTION_PRODUCTS, {'title': rng.choice(self.collections)})
+        if self.tags:
+            execute('BrowseTags', PRODUCTS_BY_TAGS, {'labels': [rng.choice(self.tags)]})
+        execute('ProductDetail', GET_PRODUCT, {'id': rng.choice(self.product_ids)})
+
+    def search(self, rng, execute):
+        execute('Search', SEARCH_PRODUCTS, {'query': rng.choice(WORDS + BRANDS)})
+        execute('Filter', FILTER_PRODUCTS, {
+            'brands': [rng.choice(self.brands)] if self.brands else None,
+            'colors': [rng.choice(self.colors)] if self.colors and rng.random() < 0.5 else None,
+        })
+
+    def cart(self, rng, execute):
+        if not self.cart_ids:
+            return self.checkout(rng, execute)
+        cart_id = rng.choice(self.cart_ids)
+        execute('Cart', GET_CART, {'id': cart_id})
+        execute('AddToCart', ADD_TO_CART, {'cartId': cart_id, 'productId': rng.choice(self.product_ids)})
+        execute('SetCartItems', SET_CART_ITEMS, {'cartId': cart_id, 'items': self.items(rng, 3)})
+
+    def checkout(self, rng, execute):
+        data = execute('CreateCart', CREATE_CART, {})
+        if not data:
+            return
+        cart_id = data['createCart']['id']
+        execute('AddItemsToCart', ADD_ITEMS_TO_CART, {'cartId': cart_id, 'items': self.items(rng)})
+        if self.customer_ids:
+            execute('Checkout', CHECKOUT, {'cartId': cart_id, 'customerId': rng.choice(self.customer_ids)})
+
+
+class InProcessClient:
+    """Executes against the schema in this process; counts queries via querystats."""
+
+    def __init__(self):
+        from .schema import schema
+        self.schema = schema
+
+    def execute(self, name, query, variables):
+        with querystats.track(f'benchmark {name}', check=False) as stats:
+            result = self.schema.execute_sync(query, variable_values=variables, operation_name=name)
+        errors = [error.message for error in result.errors or []]
+        return result.data, errors, stats.queries if stats else None
+
+
+class HttpClient:
+    """
+    POSTs to a running server. Query counts come from the Server-Timing
+    header that QueryBudgetMiddleware adds.
+    """
+
+    SERVER_TIMING_RE = re.compile(r'desc="(\d+) queries"')
+
+    def __init__(self, url, timeout=30):
+        self.url = url
+        self.timeout = timeout
+        # The view is CSRF protected; send a matching cookie and header
+        token = get_random_string(CSRF_SECRET_LENGTH)
+        self.headers = {
+            'Content-Type': 'application/json',
+            'Cookie': f'{settings.CSRF_COOKIE_NAME}={token}',
+            'X-CSRFToken': token,
+        }
+
+    def execute(self, name, query, variables):
+        body = json.dumps({'query': query, 'variables': variables, 'operationName': name}).encode()
+        request = urllib.request.Request(self.url, body, self.headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                payload = json.loads(response.read())
+                timing = self.SERVER_TIMING_RE.search(response.headers.get('Server-Timing', ''))
+        except (OSError, ValueError) as e:
+            return None, [str(e)], None
+        errors = [error.get('message', '') for error in payload.get('errors') or []]
+        return payload.get('data'), errors, int(timing.group(1)) if timing else None
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    return values[max(1, math.ceil(p / 100 * len(values))) - 1]
+
+
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # operation -> [(seconds, queries, failed)]
+        self.samples = {}
+        self.elapsed = 0.0
+
+    def add(self, name, seconds, queries, failed):
+        with self._lock:
+            self.samples.setdefault(name, []).append((seconds, queries, failed))
+
+    def summary(self):
+        operations = {}
+        for name, samples in sorted(self.samples.items()):
+            latencies = sorted(seconds for seconds, _, _ in samples)
+            queries = [count for _, count, _ in samples if count is not None]
+            operations[name] = {
+                'count': len(samples),
+                'errors': sum(failed for _, _, failed in samples),
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'mean_queries': sum(queries) / len(queries) if queries else None,
+                'max_queries': max(queries) if queries else None,
+            }
+        total = sum(len(samples) for samples in self.samples.values())
+        return {
+            'operations': operations,
+            'total': total,
+            'elapsed': self.elapsed,
+            'throughput': total / self.elapsed if self.elapsed else 0,
+        }
+
+
+def run(client_factory, workload, sessions, concurrency=1, warmup=0, on_error=None):
+    """
+    Replay `sessions` workload sessions, each worker with its own client
+    from `client_factory()`. More than one worker runs on threads. The
+    `warmup` sessions run first (caches, connections) and are not measured.
+    """
+    results = Results()
+
+    def worker(seed_offset, count, record=True):
+        client = client_factory()
+
+        def execute(name, query, variables):
+            started = time.perf_counter()
+            data, errors, queries = client.execute(name, query, variables)
+            if record:
+                results.add(name, time.perf_counter() - started, queries, bool(errors))
+            if errors and on_error:
+                on_error(name, errors)
+            return data
+
+        for kind, rng in workload.sessions(count, seed_offset):
+            workload.run(kind, rng, execute)
+
+    def threaded_worker(*args):
+        try:
+            worker(*args)
+        finally:
+            connections.close_all()
+
+    if warmup:
+        worker(-1, warmup, record=False)
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        worker(0, sessions)
+    else:
+        shares = [sessions // concurrency + (i < sessions % concurrency) for i in range(concurrency)]
+        with ThreadPoolExecutor(concurrency) as executor:
+            futures = [executor.submit(threaded_worker, i, share) for i, share in enumerate(shares) if share]
+            for future in futures:
+                future.result()
+    results.elapsed = time.perf_counter() - started
+    return results
+
+
+def compare(summary, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Regressions of `summary` against a baseline summary, as messages."""
+    regressions = []
+    for name, base in baseline['operations'].items():
+        current = summary['operations'].get(name)
+        if current is None:
+            continue
+        if current['errors'] > base['errors']:
+            regressions.append(f'{name}: {current["errors"]} errors (baseline {base["errors"]})')
+        if (
+            current['p95'] > base['p95'] * (1 + tolerance)
+            and current['p95'] - base['p95'] > MIN_SLOWDOWN
+        ):
+            regressions.append(
+                f'{name}: p95 {current["p95"] * 1000:.1f}ms (baseline {base["p95"] * 1000:.1f}ms)'
+            )
+        # Cache hits run fewer queries, so compare the worst case
+        if None not in (current['max_queries'], base['max_queries']) and current['max_queries'] > base['max_queries']:
+            regressions.append(
+                f'{name}: up to {current["max_queries"]} queries (baseline {base["max_queries"]})'
+            )
+    return regressions
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import time
+from django.conf import settings
+from django.core.cache import caches
+from graphql import OperationDefinitionNode, print_ast
+
+CACHE_ALIAS = 'catalog'
+
+# root field -> tags whose version is part of the cache key
+CACHEABLE_FIELDS = {
+    'getProducts': ['catalog', 'product', 'collection', 'promotion'],
+    'getProduct': ['catalog', 'collection', 'promotion'],
+    'getCollections': ['catalog', 'collection'],
+    'getCollectionProducts': ['catalog', 'product', 'collection', 'promotion'],
+}
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def invalidate(*tags):
+    """
+    Bump the version of every tag so cached responses depending on it are
+    never read again. Use 'catalog' after bulk queryset updates that skip
+    model signals.
+    """
+    cache = get_cache()
+    for tag in tags:
+        try:
+            cache.incr(f'version:{tag}')
+        except ValueError:
+            cache.add(f'version:{tag}', _new_version(), timeout=None)
+    # Replicas may lag the write for up to the pin window (see storefront.routers)
+    lag = getattr(settings, 'REPLICA_PIN_SECONDS', 0)
+    if lag:
+        cache.set_many({f'invalidated:{tag}': True for tag in tags}, timeout=lag)
+
+
+def recently_invalidated(tags):
+    """Whether any tag was invalidated within REPLICA_PIN_SECONDS."""
+    return bool(get_cache().get_many([f'invalidated:{tag}' for tag in tags]))
+
+
+def _new_version():
+    # A version that was evicted must not restart at a value an older
+    # cached response was keyed on, so new versions start from the clock
+    return time.time_ns()
+
+
+def _argument_value(node, variables):
+    if node.kind == 'variable':
+        return variables.get(node.name.value)
+    return getattr(node, 'value', None)
+
+
+def dependencies(document, operation_name, variables):
+    """
+    Tags the operation depends on, or None when it selects anything that
+    is not a cacheable catalog query.
+    """
+    operations = [
+        definition for definition in document.definitions
+        if isinstance(definition, OperationDefinitionNode)
+        and (operation_name is None or (definition.name and definition.name.value == operation_name))
+    ]
+    if len(operations) != 1 or operations[0].operation.value != 'query':
+        return None
+
+    tags = set()
+    for selection in operations[0].selection_set.selections:
+        name = getattr(selection, 'name', None)
+        if name is None or name.value not in CACHEABLE_FIELDS:
+            return None
+        tags.update(CACHEABLE_FIELDS[name.value])
+        if name.value == 'getProduct':
+            for argument in selection.arguments:
+                if argument.name.value == 'id':
+                    tags.add(f'product:{_argument_value(argument.value, variables or {})}')
+    return sorted(tags)
+
+
+def cache_key(document, operation_name, variables, tags):
+    cache = get_cache()
+    keys = [f'version:{tag}' for tag in tags]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, _new_version(), timeout=None)
+        # Re-read in case another process seeded the same tag first
+        versions.update(cache.get_many(missing))
+    payload = json.dumps(
+        {
+            'query': print_ast(document),
+            'operation': operation_name,
+            'variables': variables or {},
+            'versions': [versions.get(key) for key in keys],
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return 'response:' + hashlib.sha256(payload.encode()).hexdigest()
+
+
+def timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
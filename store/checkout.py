@@ -0,0 +1,57 @@
+from django.db import transaction
+from django.db.models import F
+from .cache import invalidate
+from .models import Cart, CartItem, Customer, Order, OrderItem, Product
+
+
+def checkout(cart_id, customer_id):
+    """
+    Turn a cart into an order in one transaction: snapshot discounted unit
+    prices into order items, reserve inventory and delete the cart.
+
+    Inventory is taken with conditional UPDATEs (inventory >= quantity)
+    instead of SELECT FOR UPDATE, always in product id order so concurrent
+    checkouts lock rows in the same sequence and cannot deadlock. If any
+    product is short, the whole checkout rolls back.
+    """
+    if not Customer.objects.filter(pk=customer_id).exists():
+        raise ValueError("Customer not found")
+
+    with transaction.atomic():
+        # Concurrent checkouts of one cart queue here; the later ones then
+        # find the cart gone instead of ordering it twice
+        if not Cart.objects.select_for_update().filter(pk=cart_id).exists():
+            raise ValueError("Cart not found")
+        lines = list(
+            CartItem.objects.filter(cart_id=cart_id)
+            .with_subtotals()
+            .order_by('product_id')
+            .values('product_id', 'quantity', 'unit_price')
+        )
+        if not lines:
+            raise ValueError("Cart is empty")
+
+        for line in lines:
+            reserved = Product.objects.filter(
+                pk=line['product_id'],
+                inventory__gte=line['quantity'],
+            ).update(inventory=F('inventory') - line['quantity'])
+            if not reserved:
+                raise ValueError(f"Not enough inventory for product {line['product_id']}")
+
+        order = Order.objects.create(customer_id=customer_id)
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order,
+                product_id=line['product_id'],
+                quantity=line['quantity'],
+                unit_price=line['unit_price'],
+            )
+            for line in lines
+        )
+        Cart.objects.filter(pk=cart_id).delete()
+
+        # Inventory changed through update(), which skips the model signals
+        tags = ['product', *(f"product:{line['product_id']}" for line in lines)]
+        transaction.on_commit(lambda: invalidate(*tags))
+    return order
@@ -0,0 +1,130 @@
+from graphql import (
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    GraphQLList,
+    GraphQLObjectType,
+    InlineFragmentNode,
+    OperationDefinitionNode,
+    get_named_type,
+    get_nullable_type,
+    value_from_ast_untyped,
+)
+from .pagination import MAX_PAGE_SIZE
+
+DEFAULT_LIST_SIZE = 100
+
+# Arguments that bound how many items a field returns
+PAGINATION_ARGUMENTS = ('first', 'limit')
+
+# Extra cost of fields that do more than read a column, by "Type.field"
+FIELD_WEIGHTS = {
+    'Query.searchProducts': 10,
+    'Query.filterProducts': 10,
+    'ProductConnection.totalCount': 5,
+    'CartType.totalPrice': 2,
+}
+
+# Expected sizes of unpaginated lists, by "Type.field"
+LIST_SIZES = {
+    # Paged by the parent connection's `first`
+    'ProductConnection.edges': 1,
+    'CartType.items': 50,
+    'FilteredProducts.facets': 5,
+    'Facet.values': 20,
+    # One per variant format
+    'ProductType.imageVariants': 2,
+    'ProductType.tags': 10,
+}
+
+
+class CostEstimator:
+    """
+    Static worst-case cost of an operation, computed from the document before
+    execution. Every object a field can return costs 1, scalars are free,
+    and fields in FIELD_WEIGHTS add their weight once. A field's cost is
+    multiplied by how many items it can return.
+    """
+
+    def __init__(self, schema, document, variables=None, default_list_size=DEFAULT_LIST_SIZE,
+                 max_page_size=MAX_PAGE_SIZE):
+        self.schema = schema
+        self.variables = variables or {}
+        self.default_list_size = default_list_size
+        # Connections clamp `first` to this; `limit` is costed as given
+        self.max_page_size = max_page_size
+        self.fragments = {
+            definition.name.value: definition
+            for definition in document.definitions
+            if isinstance(definition, FragmentDefinitionNode)
+        }
+        self.operations = [
+            definition for definition in document.definitions
+            if isinstance(definition, OperationDefinitionNode)
+        ]
+
+    def operation_cost(self, operation_name=None):
+        for operation in self.operations:
+            if operation_name is None or (operation.name and operation.name.value == operation_name):
+                root = self.schema.get_root_type(operation.operation)
+                return self.selection_cost(root, operation.selection_set)
+        return 0
+
+    def selection_cost(self, parent_type, selection_set, visited=frozenset()):
+        if selection_set is None:
+            return 0
+        cost = 0
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                cost += self.field_cost(parent_type, selection)
+            elif isinstance(selection, InlineFragmentNode):
+                fragment_type = parent_type
+                if selection.type_condition:
+                    fragment_type = self.schema.get_type(selection.type_condition.name.value)
+                cost += self.selection_cost(fragment_type, selection.selection_set, visited)
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                if fragment is None or name in visited:
+                    continue
+                fragment_type = self.schema.get_type(fragment.type_condition.name.value)
+                cost += self.selection_cost(fragment_type, fragment.selection_set, visited | {name})
+        return cost
+
+    def field_cost(self, parent_type, node):
+        if not isinstance(parent_type, GraphQLObjectType):
+            return 0
+        field = parent_type.fields.get(node.name.value)
+        if field is None:
+            return 0
+
+        key = f'{parent_type.name}.{node.name.value}'
+        return_type = get_nullable_type(field.type)
+        named_type = get_named_type(field.type)
+        item_cost = 1 if isinstance(named_type, GraphQLObjectType) else 0
+
+        multiplier = 1
+        limit = self.pagination_limit(field, node)
+        if limit is not None:
+            multiplier = limit
+        elif isinstance(return_type, GraphQLList):
+            multiplier = LIST_SIZES.get(key, self.default_list_size)
+
+        return FIELD_WEIGHTS.get(key, 0) + multiplier * (
+            item_cost + self.selection_cost(named_type, node.selection_set)
+        )
+
+    def pagination_limit(self, field, node):
+        arguments = {argument.name.value: argument.value for argument in node.arguments or ()}
+        for name in PAGINATION_ARGUMENTS:
+            if name in arguments:
+                value = value_from_ast_untyped(arguments[name], self.variables)
+            elif name in field.args:
+                value = field.args[name].default_value
+            else:
+                continue
+            if isinstance(value, int):
+                if name == 'first':
+                    value = min(value, self.max_page_size)
+                return max(value, 0)
+        return None
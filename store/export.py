@@ -0,0 +1,132 @@
+import csv
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from tags.models import TaggedItem
+from .models import OrderItem, Product
+
+DEFAULT_CHUNK_SIZE = 2000
+
+PRODUCT_COLUMNS = [
+    'id', 'sku', 'title', 'slug', 'brand', 'model', 'color', 'price',
+    'effective_price', 'on_sale', 'inventory', 'rating', 'popular',
+    'collection_id', 'collection_title', 'promotion_id', 'discount', 'tags',
+]
+ORDER_COLUMNS = [
+    'order_id', 'placed_at', 'payment_status', 'customer_id', 'customer_name',
+    'customer_email', 'product_id', 'sku', 'product_title', 'quantity', 'unit_price',
+]
+
+
+def iterate_in_chunks(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield lists of at most `chunk_size` objects, walking the primary key so
+    every chunk is an indexed range query. Unlike iterator(), this keeps
+    memory flat on MySQL, whose driver buffers the whole result set.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(page[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def product_rows(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    queryset = queryset.select_related('collection', 'promotion')
+    for chunk in iterate_in_chunks(queryset, chunk_size):
+        tags = TaggedItem.objects.get_tags_for_objects(Product, [product.id for product in chunk])
+        for product in chunk:
+            yield {
+                'id': product.id,
+                'sku': product.sku,
+                'title': product.title,
+                'slug': product.slug,
+                'brand': product.brand,
+                'model': product.model,
+                'color': product.color,
+                'price': product.price,
+                'effective_price': product.effective_price,
+                'on_sale': product.on_sale,
+                'inventory': product.inventory,
+                'rating': product.rating,
+                'popular': product.popular,
+                'collection_id': product.collection_id,
+                'collection_title': product.collection.title,
+                'promotion_id': product.promotion_id,
+                'discount': product.promotion.discount if product.promotion else None,
+                'tags': [tag.label for tag in tags.get(product.id, [])],
+            }
+
+
+def order_rows(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """One row per order line, so orders and their items share one file."""
+    items = (
+        OrderItem.objects
+        .filter(order__in=queryset.values('pk'))
+        .select_related('order__customer', 'product')
+    )
+    for chunk in iterate_in_chunks(items, chunk_size):
+        for item in chunk:
+            order = item.order
+            customer = order.customer
+            yield {
+                'order_id': order.id,
+                'placed_at': order.placed_at,
+                'payment_status': order.get_payment_status_display(),
+                'customer_id': customer.id,
+                'customer_name': f'{customer.first_name} {customer.last_name}',
+                'customer_email': customer.email,
+                'product_id': item.product_id,
+                'sku': item.product.sku,
+                'product_title': item.product.title,
+                'quantity': item.quantity,
+                'unit_price': item.unit_price,
+            }
+
+
+EXPORTS = {
+    'products': (product_rows, PRODUCT_COLUMNS),
+    'orders': (order_rows, ORDER_COLUMNS),
+}
+
+
+class _Echo:
+    # csv.writer only needs write(); hand each line back instead of buffering
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, columns):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(
+            '|'.join(value) if isinstance(value, list) else value
+            for value in (row[column] for column in columns)
+        )
+
+
+def jsonl_lines(rows, columns):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+WRITERS = {
+    'csv': (csv_lines, 'text/csv'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson'),
+}
+
+
+def streaming_response(name, queryset, format, chunk_size=DEFAULT_CHUNK_SIZE):
+    rows, columns = EXPORTS[name]
+    lines, content_type = WRITERS[format]
+    response = StreamingHttpResponse(
+        lines(rows(queryset, chunk_size), columns),
+        content_type=content_type,
+    )
+    response['Content-Disposition'] = f'attachment; filename="{name}.{format}"'
+    return response
@@ -0,0 +1,316 @@
+import time
+from contextvars import ContextVar
+from inspect import isawaitable
+from django.conf import settings
+from graphql import ExecutionResult, GraphQLError
+from strawberry.extensions import SchemaExtension
+from strawberry.types.graphql import OperationType
+from storefront import routers
+from storefront.routers import read_from_replica
+from . import cache, metrics, querystats
+from .cost import CostEstimator
+
+
+class CatalogCacheExtension(SchemaExtension):
+    """
+    Read-through cache for public catalog queries. Responses are stored per
+    normalized query and variables; model signals bump tag versions so stale
+    entries are simply never looked up again. Results read from a replica
+    within REPLICA_PIN_SECONDS of an invalidation are served but not stored.
+    """
+
+    def on_execute(self):
+        context = self.execution_context
+        tags = None
+        if context.result is None and context.graphql_document is not None:
+            tags = cache.dependencies(context.graphql_document, context.operation_name, context.variables)
+        if tags is None:
+            yield
+            return
+
+        key = cache.cache_key(context.graphql_document, context.operation_name, context.variables, tags)
+        data = cache.get_cache().get(key)
+        if data is not None:
+            context.result = ExecutionResult(data=data)
+            yield
+            return
+
+        yield
+        if context.result is None or context.result.errors:
+            return
+        # A replica may not have the change that bumped the version yet;
+        # caching what it returned would keep serving the old data
+        if routers.read_replica() and cache.recently_invalidated(tags):
+            return
+        cache.get_cache().set(key, context.result.data, cache.timeout())
+
+
+# Strawberry shares extension instances between operations, so state an
+# extension keeps for one operation lives in context variables
+_cost = ContextVar('graphql_query_cost', default=None)
+
+
+class QueryCostExtension(SchemaExtension):
+    """
+    Reject operations whose estimated cost exceeds GRAPHQL_MAX_QUERY_COST
+    before they run, and report the estimate under extensions.cost.
+    """
+
+    def on_operation(self):
+        _cost.set(None)
+        yield
+
+    def on_execute(self):
+        context = self.execution_context
+        if context.result is not None or context.graphql_document is None:
+            yield
+            return
+
+        estimator = CostEstimator(
+            context.schema._schema,
+            context.graphql_document,
+            context.variables,
+            default_list_size=getattr(settings, 'GRAPHQL_DEFAULT_LIST_SIZE', 100),
+        )
+        cost = estimator.operation_cost(context.operation_name)
+        _cost.set(cost)
+        maximum = getattr(settings, 'GRAPHQL_MAX_QUERY_COST', 10000)
+        if cost > maximum:
+            # Setting a result up front skips execution entirely
+            context.result = ExecutionResult(
+                data=None,
+                errors=[
+                    GraphQLError(
+                        f'Query cost {cost} exceeds the maximum of {maximum}',
+                        extensions={'code': 'QUERY_TOO_EXPENSIVE'},
+                    )
+                ],
+            )
+        yield
+
+    def get_results(self):
+        cost = _cost.get()
+        if cost is None:
+            return {}
+        return {
+            'cost': {
+                'requested': cost,
+                'maximum': getattr(settings, 'GRAPHQL_MAX_QUERY_COST', 10000),
+            }
+        }
+
+
+class ReplicaReadExtension(SchemaExtension):
+    """
+    Queries read from a replica (see storefront.routers); mutations, and
+    anything a pinned client asks for, stay on the primary.
+    """
+
+    def on_execute(self):
+        with read_from_replica(self.execution_context.operation_type == OperationType.QUERY):
+            yield
+
+
+_operation_stats = ContextVar('graphql_operation_stats', default=None)
+
+
+class QueryStatsExtension(SchemaExtension):
+    """
+    Attribute SQL queries to the GraphQL field whose resolver ran them and
+    hold the operation to the SQL budget (see store.querystats). With DEBUG
+    on, the per-field counts are returned under extensions.sql.
+    """
+
+    def on_operation(self):
+        name = self.execution_context.operation_name or 'anonymous'
+        with querystats.track(f'GraphQL operation {name}') as stats, querystats.fields():
+            # get_results() runs after the operation, once track() has ended
+            _operation_stats.set(stats)
+            yield
+
+    def resolve(self, _next, root, info, *args, **kwargs):
+        name = f'{info.parent_type.name}.{info.field_name}'
+        querystats.enter_field(name)
+        result = _next(root, info, *args, **kwargs)
+        if isawaitable(result):
+            return self._resolve_async(name, result)
+        return result
+
+    async def _resolve_async(self, name, result):
+        # Runs in the awaiting task, whose context enter_field() didn't touch
+        querystats.enter_field(name)
+        return await result
+
+    def get_results(self):
+        stats = _operation_stats.get()
+        if not settings.DEBUG or stats is None:
+            return {}
+        return {
+            'sql': {
+                'queries': stats.queries,
+                'time': stats.time,
+                'fields': stats.field_summary(),
+            }
+        }
+
+
+class _Trace:
+    def __init__(self, sampled):
+        self.operation = 'anonymous'
+        self.sampled = sampled
+        # field path -> Span, () being the operation; None when not exporting
+        self.spans = None
+
+
+# resolve() may even run on another instance than on_operation()
+_trace = ContextVar('graphql_trace', default=None)
+
+
+class TracingExtension(SchemaExtension):
+    """
+    Operation latency, errors and SQL query counts for every operation,
+    exported at /metrics (see store.metrics). A GRAPHQL_TRACE_SAMPLE_RATE
+    share of operations also times each resolver and, with GRAPHQL_TRACE_FILE
+    set, writes OpenTelemetry spans for it. Resolver errors are always
+    counted. Runs inside QueryStatsExtension to read its query counts.
+    """
+
+    def on_operation(self):
+        context = self.execution_context
+        trace = _Trace(metrics.sampled())
+        stats = querystats.current_stats()
+        queries = stats.queries if stats else 0
+        fields = {field: totals[0] for field, totals in stats.fields.items()} if stats else {}
+        if trace.sampled and getattr(settings, 'GRAPHQL_TRACE_FILE', None):
+            trace_id, parent_id = _trace_parent(context.context)
+            trace.spans = {(): metrics.Span('GraphQL operation', trace_id, parent_id)}
+        token = _trace.set(trace)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            _trace.reset(token)
+        duration = time.perf_counter() - started
+        # Known once the document is parsed
+        trace.operation = context.operation_name or 'anonymous'
+
+        operation_type = _operation_type(context)
+        labels = {'operation': trace.operation, 'type': operation_type}
+        metrics.OPERATION_DURATION.observe(duration, **labels)
+        errors = context.errors or (context.result.errors if context.result else None)
+        if errors:
+            metrics.OPERATION_ERRORS.inc(**labels)
+        if stats is not None:
+            metrics.OPERATION_QUERIES.observe(stats.queries - queries, **labels)
+            for field, (count, _) in list(stats.fields.items()):
+                count -= fields.get(field, 0)
+                if count:
+                    metrics.RESOLVER_QUERIES.inc(count, operation=trace.operation, field=field)
+
+        if trace.spans:
+            span = trace.spans[()]
+            span.name = f'GraphQL {trace.operation}'
+            span.attributes.update({'graphql.operation.name': trace.operation, 'graphql.operation.type': operation_type})
+            if stats is not None:
+                span.attributes['db.queries'] = stats.queries - queries
+            span.finish(errors[0].message if errors else None)
+            metrics.export_spans(trace.spans.values())
+
+    def on_execute(self):
+        trace = _trace.get()
+        if trace is not None:
+            trace.operation = self.execution_context.operation_name or 'anonymous'
+        yield
+
+    def resolve(self, _next, root, info, *args, **kwargs):
+        trace = _trace.get()
+        if trace is None:
+            return _next(root, info, *args, **kwargs)
+        if not trace.sampled:
+            try:
+                result = _next(root, info, *args, **kwargs)
+            except Exception:
+                _failed(trace, info)
+                raise
+            if isawaitable(result):
+                return _await_counting_errors(result, trace, info)
+            return result
+
+        start = time.time_ns()
+        started = time.perf_counter()
+        try:
+            result = _next(root, info, *args, **kwargs)
+        except Exception as e:
+            _finish(trace, info, start, started, e)
+            raise
+        if isawaitable(result):
+            return _await_timed(result, trace, info, start, started)
+        _finish(trace, info, start, started)
+        return result
+
+
+async def _await_counting_errors(result, trace, info):
+    try:
+        return await result
+    except Exception:
+        _failed(trace, info)
+        raise
+
+
+async def _await_timed(result, trace, info, start, started):
+    try:
+        result = await result
+    except Exception as e:
+        _finish(trace, info, start, started, e)
+        raise
+    _finish(trace, info, start, started)
+    return result
+
+
+def _failed(trace, info):
+    metrics.RESOLVER_ERRORS.inc(operation=trace.operation, field=f'{info.parent_type.name}.{info.field_name}')
+
+
+def _finish(trace, info, start, started, error=None):
+    field = f'{info.parent_type.name}.{info.field_name}'
+    duration = time.perf_counter() - started
+    metrics.RESOLVER_DURATION.observe(duration, operation=trace.operation, field=field)
+    if error is not None:
+        _failed(trace, info)
+    if trace.spans is None or (duration < metrics.MIN_SPAN_SECONDS and error is None):
+        return
+    path = tuple(info.path.as_list())
+    # Children hang off the nearest ancestor field that got a span
+    parent = path[:-1]
+    while parent not in trace.spans:
+        parent = parent[:-1]
+    span = metrics.Span(
+        field,
+        trace.spans[()].trace_id,
+        trace.spans[parent].span_id,
+        {'graphql.field.path': '.'.join(map(str, path)), 'graphql.field.type': str(info.return_type)},
+        start=start,
+    )
+    span.finish(str(error) if error is not None else None)
+    trace.spans[path] = span
+
+
+def _operation_type(context):
+    if context.graphql_document is None:
+        return 'unknown'
+    try:
+        return context.operation_type.value
+    except Exception:
+        return 'unknown'
+
+
+def _trace_parent(context):
+    """Join the caller's trace when the request carries a W3C traceparent."""
+    request = getattr(context, 'request', None)
+    if request is None and isinstance(context, dict):
+        request = context.get('request')
+    header = request.headers.get('traceparent', '') if request is not None else ''
+    parts = header.split('-')
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        return parts[1], parts[2]
+    return metrics.trace_id(), None
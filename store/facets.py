@@ -0,0 +1,83 @@
+from django.db.models import Case, CharField, Count, F, Q, Value, When
+from .models import Product
+
+# Bands of the sale price: (label, lower bound inclusive, upper bound exclusive)
+PRICE_BANDS = [
+    ('0-25', 0, 25),
+    ('25-50', 25, 50),
+    ('50-100', 50, 100),
+    ('100-250', 100, 250),
+    ('250+', 250, None),
+]
+
+PRICE_BAND = Case(
+    *[
+        When(Q(effective_price__gte=low) & Q(effective_price__lt=high) if high is not None else Q(effective_price__gte=low), then=Value(label))
+        for label, low, high in PRICE_BANDS
+    ],
+    output_field=CharField(),
+)
+
+# facet name -> expression the facet groups on
+FACETS = {
+    'brand': F('brand'),
+    'model': F('model'),
+    'color': F('color'),
+    'collection': F('collection__title'),
+    'price': PRICE_BAND,
+}
+
+
+def _price_band_q(labels):
+    unknown = set(labels) - {label for label, _, _ in PRICE_BANDS}
+    if unknown:
+        raise ValueError(f"Unknown price band: {', '.join(sorted(unknown))}")
+    q = Q()
+    for label, low, high in PRICE_BANDS:
+        if label in labels:
+            q |= Q(effective_price__gte=low, effective_price__lt=high) if high is not None else Q(effective_price__gte=low)
+    return q
+
+
+def _facet_q(name, values):
+    if name == 'price':
+        return _price_band_q(values)
+    if name == 'collection':
+        return Q(collection__title__in=values)
+    return Q(**{f'{name}__in': values})
+
+
+def filter_products(selection, exclude=None):
+    """
+    Products matching `selection` ({facet name: [values]}). Values of one
+    facet are OR-ed, facets are AND-ed. `exclude` skips one facet, which is
+    what its own counts are computed against.
+    """
+    queryset = Product.objects.all()
+    for name, values in selection.items():
+        if values and name != exclude:
+            queryset = queryset.filter(_facet_q(name, values))
+    return queryset
+
+
+def facet_counts(selection):
+    """
+    Count products per value of every facet in a single UNION ALL query.
+    Each facet is counted with the other facets' selections applied, so a
+    sidebar can show how many products picking another value would give.
+    """
+    branches = [
+        filter_products(selection, exclude=name)
+        .order_by()
+        .annotate(facet=Value(name, output_field=CharField()), value=expression)
+        .values('facet', 'value')
+        .annotate(count=Count('id'))
+        for name, expression in FACETS.items()
+    ]
+    counts = {name: [] for name in FACETS}
+    for row in branches[0].union(*branches[1:], all=True):
+        if row['value'] is not None:
+            counts[row['facet']].append((row['value'], row['count']))
+    for values in counts.values():
+        values.sort(key=lambda item: (-item[1], item[0]))
+    return counts
@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.db import connections, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+from .cache import invalidate
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (160, 320, 640, 1280)
+# format -> (file extension, Pillow save options)
+VARIANT_FORMATS = {
+    'webp': ('webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+VARIANT_ROOT = 'product_images/variants'
+UPLOAD_ROOT = 'product_images/originals'
+# Pillow format -> file extension
+UPLOAD_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+_executor = None
+
+
+def content_hash(file):
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def variant_name(image_hash, width, format):
+    extension, _ = VARIANT_FORMATS[format]
+    return posixpath.join(VARIANT_ROOT, image_hash[:2], image_hash, f'{width}.{extension}')
+
+
+def variant_url(image_hash, width, format):
+    return default_storage.url(variant_name(image_hash, width, format))
+
+
+def pick_width(width=None):
+    """The smallest variant at least `width` pixels wide, else the largest."""
+    if width is not None:
+        for candidate in VARIANT_WIDTHS:
+            if candidate >= width:
+                return candidate
+    return VARIANT_WIDTHS[-1]
+
+
+def upload_too_large_message():
+    return f"Image is larger than {settings.PRODUCT_IMAGE_MAX_UPLOAD_SIZE // (1024 * 1024)} MB"
+
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    """
+    Streams uploads to temporary files like TemporaryFileUploadHandler, but
+    stops reading as soon as a file passes PRODUCT_IMAGE_MAX_UPLOAD_SIZE so
+    an oversized upload is never written to disk in full. The request is
+    marked with `upload_too_large` for the view to report.
+    """
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.PRODUCT_IMAGE_MAX_UPLOAD_SIZE:
+            self.request.upload_too_large = True
+            # The parser closes (and so deletes) the temporary file
+            raise StopUpload(connection_reset=False)
+        return super().receive_data_chunk(raw_data, start)
+
+
+def save_upload(upload):
+    """
+    Store an uploaded image under its content hash and return the storage
+    name for Product.image. An identical image uploaded again reuses the
+    stored file instead of writing a copy.
+    """
+    if upload.size > settings.PRODUCT_IMAGE_MAX_UPLOAD_SIZE:
+        raise ValueError(upload_too_large_message())
+    try:
+        with Image.open(upload) as image:
+            format = image.format
+            image.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        raise ValueError("Upload is not a valid image")
+    if format not in UPLOAD_FORMATS:
+        raise ValueError(f"Unsupported image format {format}")
+
+    upload.seek(0)
+    image_hash = content_hash(upload)
+    name = posixpath.join(UPLOAD_ROOT, image_hash[:2], f'{image_hash}.{UPLOAD_FORMATS[format]}')
+    if not default_storage.exists(name):
+        upload.seek(0)
+        name = default_storage.save(name, upload)
+    return name
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _encode(image, format):
+    _, options = VARIANT_FORMATS[format]
+    if format == 'jpeg' and _has_alpha(image):
+        # JPEG has no alpha channel, so flatten onto white
+        rgba = image.convert('RGBA')
+        image = Image.new('RGB', image.size, 'white')
+        image.paste(rgba, mask=rgba.getchannel('A'))
+    elif format == 'jpeg' or image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if _has_alpha(image) else 'RGB')
+    buffer = BytesIO()
+    image.save(buffer, format=format.upper(), **options)
+    return ContentFile(buffer.getvalue())
+
+
+def write_variants(file, image_hash):
+    """
+    Save every width/format variant of `file` that isn't on disk yet.
+    Identical uploads share a hash, so they share variants too. Images are
+    never upscaled: widths past the original are stored at original size.
+    """
+    with Image.open(file) as original:
+        original = ImageOps.exif_transpose(original)
+        for width in VARIANT_WIDTHS:
+            names = {format: variant_name(image_hash, width, format) for format in VARIANT_FORMATS}
+            missing = [format for format, name in names.items() if not default_storage.exists(name)]
+            if not missing:
+                continue
+            resized = original.copy()
+            resized.thumbnail((width, width * 4), Image.LANCZOS)
+            for format in missing:
+                default_storage.save(names[format], _encode(resized, format))
+
+
+def generate_variants(product_id):
+    product = Product.objects.filter(pk=product_id).only('id', 'image', 'image_hash').first()
+    if product is None or not product.image:
+        return None
+    with product.image.open('rb') as file:
+        image_hash = content_hash(file)
+        file.seek(0)
+        write_variants(file, image_hash)
+    if image_hash != product.image_hash:
+        # update() so this doesn't fire post_save and schedule itself again
+        Product.objects.filter(pk=product_id).update(image_hash=image_hash)
+        invalidate('product', f'product:{product_id}')
+    return image_hash
+
+
+def _run(product_id):
+    try:
+        generate_variants(product_id)
+    except Exception:
+        logger.exception('Could not generate image variants for product %s', product_id)
+    finally:
+        # Worker threads open their own connections; don't leak them
+        connections.close_all()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_VARIANT_WORKERS,
+            thread_name_prefix='image-variants',
+        )
+    return _executor
+
+
+def schedule_variants(product_id):
+    """
+    Generate variants once the current transaction commits: on the worker
+    pool, or inline when IMAGE_VARIANT_WORKERS is 0 (tests, scripts).
+    """
+    def submit():
+        if settings.IMAGE_VARIANT_WORKERS:
+            _get_executor().submit(_run, product_id)
+        else:
+            generate_variants(product_id)
+    transaction.on_commit(submit)
@@ -0,0 +1,230 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from django.db import connection, transaction
+from .cache import invalidate
+from .images import schedule_variants
+from .models import Collection, Product, Promotion
+from .search import FIELD_WEIGHTS, index_products
+
+DEFAULT_BATCH_SIZE = 1000
+# Always present, since build_product requires them
+REQUIRED_UPDATE_FIELDS = ['title', 'price', 'inventory', 'collection']
+# Optional input columns and the fields they update; a column missing from
+# the file leaves existing values alone
+OPTIONAL_UPDATE_FIELDS = {
+    'image': ['image', 'image_hash'],
+    'brand': ['brand'],
+    'model': ['model'],
+    'color': ['color'],
+    'slug': ['slug'],
+    'popular': ['popular'],
+    'rating': ['rating'],
+    'description': ['description'],
+    'discount': ['promotion'],
+}
+
+
+class ImportRowError(ValueError):
+    def __init__(self, line, message):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+
+def read_csv(file):
+    # Line 1 is the header
+    for line, row in enumerate(csv.DictReader(file), start=2):
+        yield line, row
+
+
+def read_jsonl(file):
+    for line, text in enumerate(file, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except json.JSONDecodeError:
+            # Reported by build_product, so one bad line doesn't stop the import
+            row = None
+        yield line, row
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+class LookupCache:
+    """
+    Collections and promotions seen during an import, so each title or
+    discount costs at most one query however many rows reference it.
+    """
+    def __init__(self):
+        self.collections = dict(Collection.objects.values_list('title', 'id'))
+        self.promotions = {}
+
+    def collection_id(self, title):
+        if title not in self.collections:
+            self.collections[title] = Collection.objects.create(title=title).id
+        return self.collections[title]
+
+    def promotion(self, discount):
+        if discount not in self.promotions:
+            promotion = (
+                Promotion.objects
+                .filter(discount=discount, status=Promotion.STATUS_ACTIVE)
+                .order_by('id')
+                .first()
+            )
+            if promotion is None:
+                promotion = Promotion.objects.create(discount=discount)
+            self.promotions[discount] = promotion
+        return self.promotions[discount]
+
+
+def _text(row, field):
+    value = row.get(field)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _bool(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return value
+    return value.lower() in ('1', 'true', 'yes', 'y')
+
+
+def build_product(line, row, lookups):
+    if not isinstance(row, dict):
+        raise ImportRowError(line, 'not a JSON object')
+    sku = _text(row, 'sku')
+    title = _text(row, 'title')
+    collection_title = _text(row, 'collection_title')
+    if not sku or not title or not collection_title:
+        raise ImportRowError(line, 'sku, title and collection_title are required')
+    try:
+        price = Decimal(str(row['price']))
+        inventory = int(row['inventory'])
+        discount = _text(row, 'discount')
+        discount = int(discount) if discount is not None else None
+        rating = _text(row, 'rating')
+        rating = float(rating) if rating is not None else None
+    except KeyError as e:
+        raise ImportRowError(line, f'missing {e.args[0]}')
+    except (InvalidOperation, ValueError, TypeError):
+        raise ImportRowError(line, 'price, inventory, discount and rating must be numbers')
+
+    return Product(
+        sku=sku,
+        image=_text(row, 'image'),
+        title=title,
+        brand=_text(row, 'brand'),
+        model=_text(row, 'model'),
+        color=_text(row, 'color'),
+        slug=_text(row, 'slug') or '',
+        popular=_bool(_text(row, 'popular')),
+        rating=rating,
+        description=_text(row, 'description'),
+        price=price,
+        inventory=inventory,
+        collection_id=lookups.collection_id(collection_title),
+        promotion=lookups.promotion(discount) if discount else None,
+    )
+
+
+def update_fields(row):
+    fields = list(REQUIRED_UPDATE_FIELDS)
+    for column, column_fields in OPTIONAL_UPDATE_FIELDS.items():
+        if column in row:
+            fields.extend(column_fields)
+    return fields
+
+
+def upsert_batch(products, fields, index=True):
+    """
+    Insert new products and update `fields` of existing ones (matched on
+    sku). A changed image clears image_hash and queues new variants.
+    """
+    skus = [product.sku for product in products]
+    changed_images = []
+    if 'image' in fields:
+        existing = {
+            sku: (image, image_hash)
+            for sku, image, image_hash in Product.objects.filter(sku__in=skus).values_list('sku', 'image', 'image_hash')
+        }
+        for product in products:
+            image, image_hash = existing.get(product.sku, (None, ''))
+            if (product.image.name or '') == (image or ''):
+                product.image_hash = image_hash
+            elif product.image:
+                changed_images.append(product.sku)
+
+    # MySQL has no conflict target; its ON DUPLICATE KEY uses the sku index
+    unique_fields = ['sku'] if connection.features.supports_update_conflicts_with_target else None
+    with transaction.atomic():
+        Product.objects.bulk_create(
+            products,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=fields,
+        )
+        products_by_sku = Product.objects.filter(sku__in=skus)
+        # bulk_create skips Product.save(), and the promotion may be unchanged
+        products_by_sku.refresh_effective_prices()
+        if changed_images:
+            # MySQL doesn't return ids from an upsert, so look them up by sku
+            ids = dict(products_by_sku.filter(sku__in=changed_images).values_list('sku', 'id'))
+            for sku in changed_images:
+                schedule_variants(ids[sku])
+        if index:
+            # Index the rows as stored: columns missing from the file kept
+            # their old values, which the in-memory products don't have
+            index_products(list(products_by_sku.only('id', *FIELD_WEIGHTS)))
+
+
+def _flush(batch, index):
+    # Rows of one JSONL file may carry different columns
+    groups = {}
+    for product, fields in batch.values():
+        groups.setdefault(tuple(fields), []).append(product)
+    for fields, products in groups.items():
+        upsert_batch(products, list(fields), index=index)
+
+
+def import_products(rows, batch_size=DEFAULT_BATCH_SIZE, index=True, on_error=None, on_batch=None):
+    """
+    Upsert products keyed on sku from an iterable of (line, row) pairs,
+    `batch_size` rows per INSERT. Rows that fail validation are passed to
+    `on_error` (or raised if it is None). Returns (imported, skipped).
+    """
+    lookups = LookupCache()
+    batch = {}
+    imported = skipped = 0
+    for line, row in rows:
+        try:
+            product = build_product(line, row, lookups)
+        except ImportRowError as e:
+            if on_error is None:
+                raise
+            on_error(e)
+            skipped += 1
+            continue
+        # The last row wins when a file repeats a sku within one batch
+        batch[product.sku] = (product, update_fields(row))
+        if len(batch) >= batch_size:
+            _flush(batch, index)
+            imported += len(batch)
+            batch = {}
+            if on_batch:
+                on_batch(imported)
+    if batch:
+        _flush(batch, index)
+        imported += len(batch)
+    if imported:
+        invalidate('catalog')
+    return imported, skipped
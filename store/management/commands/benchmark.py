@@ -0,0 +1,82 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from store.benchmark import DEFAULT_TOLERANCE, HttpClient, InProcessClient, Workload, compare, run
+
+
+def _ms(seconds):
+    return f'{seconds * 1000:.1f}' if seconds is not None else '-'
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a mixed browse/search/cart/checkout workload against the GraphQL API '
+        'and report latency percentiles, queries per operation and throughput'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='GraphQL endpoint of a running server; runs in-process by default')
+        parser.add_argument('--sessions', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=20, help='Unmeasured sessions run first')
+        parser.add_argument('--concurrency', type=int, default=1)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', help='Fail if slower or running more queries than this result file')
+        parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                            help='Allowed p95 slowdown against the baseline, as a fraction')
+        parser.add_argument('--output', help='Write the result as JSON, e.g. to store as a baseline')
+
+    def handle(self, *args, **options):
+        if options['sessions'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--sessions and --concurrency must be at least 1')
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as file:
+                    baseline = json.load(file)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Cannot read baseline: {e}')
+
+        url = options['url']
+        try:
+            workload = Workload(seed=options['seed'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        errors = {}
+
+        def on_error(name, messages):
+            errors.setdefault(name, messages[0])
+
+        results = run(
+            (lambda: HttpClient(url)) if url else InProcessClient,
+            workload,
+            options['sessions'],
+            concurrency=options['concurrency'],
+            warmup=options['warmup'],
+            on_error=on_error,
+        )
+        summary = results.summary()
+        summary['mode'] = url or 'in-process'
+        summary['concurrency'] = options['concurrency']
+
+        self.stdout.write(f'{"operation":<18} {"count":>6} {"errors":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8}')
+        for name, row in summary['operations'].items():
+            queries = f'{row["mean_queries"]:.1f}' if row['mean_queries'] is not None else '-'
+            self.stdout.write(
+                f'{name:<18} {row["count"]:>6} {row["errors"]:>6} {_ms(row["p50"]):>8} '
+                f'{_ms(row["p95"]):>8} {_ms(row["p99"]):>8} {queries:>8}'
+            )
+        for name, message in errors.items():
+            self.stderr.write(f'{name} failed: {message}')
+        self.stdout.write(
+            f'{summary["total"]} operations in {summary["elapsed"]:.1f}s '
+            f'({summary["throughput"]:.1f} operations/sec)'
+        )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(summary, file, indent=2)
+
+        if baseline is not None:
+            regressions = compare(summary, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
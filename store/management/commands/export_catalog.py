@@ -0,0 +1,33 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from store.export import DEFAULT_CHUNK_SIZE, EXPORTS, WRITERS
+from store.models import Order, Product
+
+QUERYSETS = {
+    'products': lambda: Product.objects.all(),
+    'orders': lambda: Order.objects.all(),
+}
+
+
+class Command(BaseCommand):
+    help = 'Stream products or orders (one row per order line) as CSV or JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('what', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(WRITERS), default='csv')
+        parser.add_argument('--output', help='Defaults to stdout')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        rows, columns = EXPORTS[options['what']]
+        lines, _ = WRITERS[options['format']]
+        output = options['output']
+        file = open(output, 'w', newline='', encoding='utf-8') if output else sys.stdout
+        try:
+            for line in lines(rows(QUERYSETS[options['what']](), options['chunk_size']), columns):
+                file.write(line)
+        finally:
+            if output:
+                file.close()
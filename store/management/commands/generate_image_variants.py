@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from store.images import generate_variants
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Generate missing resized variants for every product image'
+
+    def handle(self, *args, **options):
+        generated = 0
+        ids = Product.objects.exclude(image='').exclude(image=None).values_list('id', flat=True)
+        for product_id in ids.iterator():
+            if generate_variants(product_id):
+                generated += 1
+        self.stdout.write(self.style.SUCCESS(f'Processed images of {generated} products'))
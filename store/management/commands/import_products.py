@@ -0,0 +1,52 @@
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from store.importer import DEFAULT_BATCH_SIZE, READERS, import_products
+
+
+class Command(BaseCommand):
+    help = 'Upsert products (keyed on sku) from a CSV or JSONL file, streamed row by row'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(READERS),
+                            help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--skip-index', action='store_true',
+                            help='Leave the search index for rebuild_search_index')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if format not in READERS:
+            raise CommandError(f'Unknown format {format!r}; pass --format')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        started = time.monotonic()
+
+        def on_batch(imported):
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'{imported} rows ({imported / elapsed:.0f} rows/sec)')
+
+        def on_error(error):
+            self.stderr.write(f'Skipped {error}')
+
+        try:
+            file = open(path, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(str(e))
+        with file:
+            imported, skipped = import_products(
+                READERS[format](file),
+                batch_size=options['batch_size'],
+                index=not options['skip_index'],
+                on_error=on_error,
+                on_batch=on_batch,
+            )
+        elapsed = time.monotonic() - started
+        rate = imported / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} products, skipped {skipped} rows '
+            f'in {elapsed:.1f}s ({rate:.0f} rows/sec)'
+        ))
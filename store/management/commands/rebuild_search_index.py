@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from store.models import ProductSearchTerm
+from store.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {ProductSearchTerm.objects.count()} search terms'
+        ))
@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from store.benchmark import DEFAULT_SCALE, SKU_PREFIX, seed
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with a synthetic catalog for the benchmark command'
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_SCALE.items():
+            parser.add_argument(f'--{name}', type=int, default=default)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if Product.objects.filter(sku__startswith=SKU_PREFIX).exists():
+            raise CommandError('The database already holds a benchmark catalog')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        started = time.monotonic()
+        seed(
+            {name: options[name] for name in DEFAULT_SCALE},
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            on_progress=lambda step: self.stdout.write(f'{step} ({time.monotonic() - started:.1f}s)'),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {options["products"]} products in {time.monotonic() - started:.1f}s'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from store.promotions import DEFAULT_BATCH_SIZE, sweep_promotions
+
+
+class Command(BaseCommand):
+    help = 'Start scheduled promotions and expire finished ones (run from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started, expired = sweep_promotions(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{started} promotions started, {expired} promotions expired'
+        ))
@@ -0,0 +1,234 @@
+"""
+In-process metrics in the Prometheus text exposition format, plus an
+optional OpenTelemetry (OTLP/JSON) span file for sampled GraphQL
+operations. Counters live in the worker process; scrape every worker.
+"""
+import json
+import os
+import random
+import threading
+import time
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# Label sets past this many per metric are folded into one 'other' series,
+# since operation names come from clients
+MAX_SERIES = 1000
+OTHER = 'other'
+# Faster resolvers are timed but get no span of their own
+MIN_SPAN_SECONDS = 0.001
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        if key not in self._series and len(self._series) >= MAX_SERIES:
+            key = (OTHER,) * len(self.labels)
+        return key
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            series = list(self._series.items())
+        for key, value in series:
+            lines.extend(self._sample_lines(key, value))
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _sample_lines(self, key, value):
+        return [f'{self.name}{_format_labels(self.labels, key)} {value}']
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                # per-bucket counts (not cumulative), sum, count
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def _sample_lines(self, key, value):
+        counts, total, count = value
+        names = (*self.labels, 'le')
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets, counts):
+            cumulative += bucket
+            lines.append(f'{self.name}_bucket{_format_labels(names, (*key, bound))} {cumulative}')
+        lines.append(f'{self.name}_bucket{_format_labels(names, (*key, "+Inf"))} {count}')
+        lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total}')
+        lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+
+OPERATION_DURATION = Histogram(
+    'graphql_operation_duration_seconds', 'GraphQL operation latency', ['operation', 'type'],
+)
+OPERATION_ERRORS = Counter(
+    'graphql_operation_errors_total', 'GraphQL operations that returned errors', ['operation', 'type'],
+)
+OPERATION_QUERIES = Histogram(
+    'graphql_operation_db_queries', 'SQL queries per GraphQL operation', ['operation', 'type'],
+    buckets=QUERY_BUCKETS,
+)
+RESOLVER_DURATION = Histogram(
+    'graphql_resolver_duration_seconds', 'Resolver latency (sampled operations only)', ['operation', 'field'],
+)
+RESOLVER_ERRORS = Counter(
+    'graphql_resolver_errors_total', 'Resolvers that raised', ['operation', 'field'],
+)
+RESOLVER_QUERIES = Counter(
+    'graphql_resolver_db_queries_total', 'SQL queries run by each resolver', ['operation', 'field'],
+)
+
+METRICS = [
+    OPERATION_DURATION, OPERATION_ERRORS, OPERATION_QUERIES,
+    RESOLVER_DURATION, RESOLVER_ERRORS, RESOLVER_QUERIES,
+]
+
+
+def _pool_lines():
+    from storefront.db import pool
+
+    names = {
+        'open': 'Connections open', 'idle': 'Connections idle', 'in_use': 'Connections checked out',
+    }
+    counters = {
+        'checkouts': 'Connection checkouts', 'waits': 'Checkouts that waited for a connection',
+        'wait_seconds': 'Seconds spent waiting for a connection', 'timeouts': 'Checkouts that timed out',
+    }
+    stats = pool.stats()
+    lines = []
+    for key, help in names.items():
+        lines += [f'# HELP db_pool_{key} {help}', f'# TYPE db_pool_{key} gauge']
+        lines += [f'db_pool_{key}{{database="{alias}"}} {values[key]}' for alias, values in stats.items()]
+    for key, help in counters.items():
+        lines += [f'# HELP db_pool_{key}_total {help}', f'# TYPE db_pool_{key}_total counter']
+        lines += [f'db_pool_{key}_total{{database="{alias}"}} {values[key]}' for alias, values in stats.items()]
+    return lines
+
+
+def exposition():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    lines.extend(_pool_lines())
+    return '\n'.join(lines) + '\n'
+
+
+def sample_rate():
+    return getattr(settings, 'GRAPHQL_TRACE_SAMPLE_RATE', 0.1)
+
+
+def sampled():
+    rate = sample_rate()
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def _span_id(bits=64):
+    return f'{random.getrandbits(bits):0{bits // 4}x}'
+
+
+def trace_id():
+    return _span_id(128)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id=None, attributes=None, start=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _span_id()
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.start = start if start is not None else time.time_ns()
+        self.end = None
+        self.error = None
+
+    def finish(self, error=None):
+        self.end = time.time_ns()
+        self.error = error
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end or self.start),
+            'attributes': [
+                {'key': key, 'value': {'stringValue': str(value)}} for key, value in self.attributes.items()
+            ],
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 1},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+_write_lock = threading.Lock()
+
+
+def export_spans(spans):
+    """
+    Append the spans to GRAPHQL_TRACE_FILE as one OTLP/JSON line, the
+    format the OpenTelemetry Collector's otlpjsonfile receiver reads.
+    """
+    path = getattr(settings, 'GRAPHQL_TRACE_FILE', None)
+    if not path or not spans:
+        return
+    line = json.dumps({
+        'resourceSpans': [{
+            'resource': {'attributes': [
+                {'key': 'service.name', 'value': {'stringValue': 'storefront'}},
+                {'key': 'process.pid', 'value': {'intValue': str(os.getpid())}},
+            ]},
+            'scopeSpans': [{
+                'scope': {'name': 'store.metrics'},
+                'spans': [span.to_otlp() for span in spans],
+            }],
+        }],
+    })
+    with _write_lock, open(path, 'a', encoding='utf-8') as file:
+        file.write(line + '\n')
@@ -0,0 +1,82 @@
+# Generated by Django 5.1.5 on 2026-10-18 01:59
+
+from django.db import migrations, models
+from django.db.models import DecimalField, Exists, ExpressionWrapper, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Round
+
+
+def fill_effective_prices(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Promotion = apps.get_model('store', 'Promotion')
+    discount = Coalesce(
+        Subquery(Promotion.objects.filter(pk=OuterRef('promotion_id')).values('discount')[:1]),
+        Value(0),
+    )
+    Product.objects.update(
+        effective_price=Round(
+            ExpressionWrapper(
+                F('price') * (100 - discount) / 100,
+                output_field=DecimalField(max_digits=10, decimal_places=4),
+            ),
+            2,
+            output_field=DecimalField(max_digits=6, decimal_places=2),
+        ),
+        on_sale=Exists(Promotion.objects.filter(pk=OuterRef('promotion_id'), discount__gt=0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0025_product_facet_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_brand_price_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_model_price_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_color_price_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_collection_price_idx',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=6),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='on_sale',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(fill_effective_prices, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['effective_price', 'id'], name='product_eff_price_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['brand', 'effective_price'], name='product_brand_eff_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['model', 'effective_price'], name='product_model_eff_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['color', 'effective_price'], name='product_color_eff_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['collection', 'effective_price'], name='product_coll_eff_price_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.5 on 2026-10-18 02:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0026_product_effective_price'),
+        ('tags', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromotionTarget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('brand', models.CharField(blank=True, max_length=255, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='ends_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='starts_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='status',
+            field=models.CharField(choices=[('S', 'Scheduled'), ('A', 'Active'), ('E', 'Expired')], default='A', max_length=1),
+        ),
+        migrations.AddIndex(
+            model_name='promotion',
+            index=models.Index(fields=['status', 'starts_at'], name='promotion_status_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='promotion',
+            index=models.Index(fields=['status', 'ends_at'], name='promotion_status_end_idx'),
+        ),
+        migrations.AddField(
+            model_name='promotiontarget',
+            name='collection',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='store.collection'),
+        ),
+        migrations.AddField(
+            model_name='promotiontarget',
+            name='promotion',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='targets', to='store.promotion'),
+        ),
+        migrations.AddField(
+            model_name='promotiontarget',
+            name='tag',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='tags.tag'),
+        ),
+    ]
@@ -1,9 +1,16 @@
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.contenttypes.fields import GenericRelation
+from django.db import connections, models, router
+from decimal import ROUND_HALF_UP, Decimal
+from django.db.models import DecimalField, Exists, ExpressionWrapper, F, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+from tags.models import TaggedItem
 
 class Collection(models.Model):
-    title = models.CharField(max_length=255)
+    title = models.CharField(max_length=255, db_index=True)
     featured_product = models.ForeignKey('Product', on_delete=models.SET_NULL, null=True, related_name='+')
 
     def __str__(self) -> str:
@@ -14,15 +21,117 @@ class Collection(models.Model):
     
 
 class Promotion(models.Model):
+    STATUS_SCHEDULED = 'S'
+    STATUS_ACTIVE = 'A'
+    STATUS_EXPIRED = 'E'
+    STATUS_CHOICES = [
+        (STATUS_SCHEDULED, 'Scheduled'),
+        (STATUS_ACTIVE, 'Active'),
+        (STATUS_EXPIRED, 'Expired'),
+    ]
     description = models.CharField(max_length=255)
     discount = models.IntegerField()
+    starts_at = models.DateTimeField(null=True, blank=True)
+    ends_at = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=STATUS_ACTIVE)
 
     def __str__(self) -> str:
         return (str(self.discount)+'%')
+
+    def clean(self):
+        if self.starts_at and self.ends_at and self.ends_at <= self.starts_at:
+            raise ValidationError({'ends_at': 'A promotion must end after it starts.'})
+
+    def save(self, *args, **kwargs):
+        # A promotion starting later waits for sweep_promotions to apply it
+        if self.status == self.STATUS_ACTIVE and self.starts_at and self.starts_at > timezone.now():
+            self.status = self.STATUS_SCHEDULED
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'status'}
+        super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'starts_at'], name='promotion_status_start_idx'),
+            models.Index(fields=['status', 'ends_at'], name='promotion_status_end_idx'),
+            models.Index(fields=['discount', 'status'], name='promotion_discount_status_idx'),
+        ]
+
+
+class PromotionTarget(models.Model):
+    """
+    Which products a scheduled promotion applies to. Each row targets a
+    collection, a brand or a tag; a product matching any row is included.
+    """
+    promotion = models.ForeignKey(Promotion, on_delete=models.CASCADE, related_name='targets')
+    collection = models.ForeignKey('Collection', on_delete=models.CASCADE, null=True, blank=True)
+    brand = models.CharField(max_length=255, null=True, blank=True)
+    tag = models.ForeignKey('tags.Tag', on_delete=models.CASCADE, null=True, blank=True)
+
+    def clean(self):
+        if not (self.collection_id or self.brand or self.tag_id):
+            raise ValidationError('Pick a collection, a brand or a tag.')
     
 
+def discounted_price(price, discount):
+    # Rounded half up to 2 decimal places, like ROUND() in SQL
+    price = Decimal(str(price))
+    return (price - (price * discount) / 100).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def tagged_items_prefetch():
+    return Prefetch('tagged_items', queryset=TaggedItem.objects.select_related('tag'))
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_tags(self):
+        """Load the tagged items (and tags) of every product in one extra query."""
+        return self.prefetch_related(tagged_items_prefetch())
+
+    def refresh_effective_prices(self):
+        """
+        Recompute effective_price and on_sale for every product in the
+        queryset with a single UPDATE. Use after bulk price changes or
+        promotion edits, which bypass Product.save().
+        """
+        discount = Coalesce(
+            Subquery(Promotion.objects.filter(pk=OuterRef('promotion_id')).values('discount')[:1]),
+            Value(0),
+        )
+        return self.update(
+            effective_price=self._effective_price(discount),
+            on_sale=Exists(Promotion.objects.filter(pk=OuterRef('promotion_id'), discount__gt=0)),
+        )
+
+    def set_promotion(self, promotion):
+        """
+        Attach `promotion` (or None) to every product in the queryset and
+        reprice them in the same UPDATE.
+        """
+        discount = promotion.discount if promotion else 0
+        return self.update(
+            promotion=promotion,
+            effective_price=self._effective_price(Value(discount)),
+            on_sale=discount > 0,
+        )
+
+    @staticmethod
+    def _effective_price(discount):
+        return Round(
+            ExpressionWrapper(
+                F('price') * (100 - discount) / 100,
+                output_field=DecimalField(max_digits=10, decimal_places=4),
+            ),
+            2,
+            output_field=DecimalField(max_digits=6, decimal_places=2),
+        )
+
+
 class Product(models.Model):
     image = models.ImageField(upload_to='product_images/', null=True, blank=True)
+    # Stable key for catalog syncs (see the import_products command)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     title = models.CharField(max_length=255)
     brand = models.CharField(max_length=255, null=True, blank=True)
     model = models.CharField(max_length=255, null=True, blank=True)
@@ -40,23 +149,70 @@ class Product(models.Model):
     last_update = models.DateTimeField(auto_now=True)
     collection = models.ForeignKey(Collection, on_delete=models.PROTECT)
     promotion = models.ForeignKey(Promotion,  on_delete=models.PROTECT, null=True)
+    # Denormalized from price and promotion so sale prices can be sorted and
+    # filtered in SQL; kept in sync by save() and refresh_effective_prices()
+    effective_price = models.DecimalField(max_digits=6, decimal_places=2, default=0, editable=False)
+    on_sale = models.BooleanField(default=False, editable=False)
+    # sha256 of the original image, naming its resized variants (store.images)
+    image_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+    tagged_items = GenericRelation(TaggedItem)
+
+    objects = ProductQuerySet.as_manager()
 
     def __str__(self) -> str:
         return self.title
     
     class Meta:
         ordering = ['title']
+        indexes = [
+            models.Index(fields=['title', 'id'], name='product_title_id_idx'),
+            models.Index(fields=['effective_price', 'id'], name='product_eff_price_id_idx'),
+            models.Index(fields=['brand', 'effective_price'], name='product_brand_eff_price_idx'),
+            models.Index(fields=['model', 'effective_price'], name='product_model_eff_price_idx'),
+            models.Index(fields=['color', 'effective_price'], name='product_color_eff_price_idx'),
+            models.Index(fields=['collection', 'effective_price'], name='product_coll_eff_price_idx'),
+            models.Index(fields=['collection', 'title', 'id'], name='product_coll_title_id_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets post_save tell a newly uploaded image from an unchanged one
+        if 'image' in field_names:
+            instance._loaded_image = instance.image.name
+        return instance
+
+    def save(self, *args, **kwargs):
+        discount = self.promotion.discount if self.promotion_id else 0
+        self.effective_price = discounted_price(self.price, discount)
+        self.on_sale = discount > 0
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = update_fields = {*update_fields, 'effective_price', 'on_sale'}
+        # The old image's variants must not be served for a new one
+        saves_image = 'image' in update_fields if update_fields is not None else 'image' not in self.get_deferred_fields()
+        if saves_image and (self.image.name or None) != (getattr(self, '_loaded_image', None) or None):
+            self.image_hash = ''
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'image_hash'}
+        super().save(*args, **kwargs)
 
     @property
     def price_after_discount(self):
-        if self.promotion:
-            discount_amount = (self.price * self.promotion.discount) / 100
-            return round(self.price - discount_amount, 2)  # Rounded to 2 decimal places
-        return self.price  # No discount applied
-    
-    @property
-    def on_sale(self):
-        return (self.promotion and self.promotion.discount > 0 )
+        return self.effective_price
+
+class ProductSearchTerm(models.Model):
+    """
+    Inverted index row: one per distinct word of a product, weighted by the
+    fields it appears in. Maintained by store.search on product save.
+    """
+    term = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_terms')
+    weight = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = [['term', 'product']]
+
 
 class Customer(models.Model):
     MEMBERSHIP_BRONZE = 'B'
@@ -96,12 +252,58 @@ class Order(models.Model):
     payment_status = models.CharField(max_length=1,  choices=PAYMENT_STATUS_CHOICES, default=PENDIND_STATE)
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['placed_at'], name='order_placed_at_idx'),
+            models.Index(fields=['customer', 'placed_at'], name='order_customer_placed_idx'),
+        ]
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.PROTECT)
     product = models.ForeignKey(Product, on_delete=models.PROTECT)
     quantity = models.PositiveSmallIntegerField()
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
 
+class CartItemQuerySet(models.QuerySet):
+    UNIT_PRICE = F('product__effective_price')
+    SUBTOTAL = ExpressionWrapper(
+        UNIT_PRICE * F('quantity'),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+    def with_subtotals(self):
+        return self.annotate(unit_price=self.UNIT_PRICE, subtotal=self.SUBTOTAL)
+
+    def total_price(self):
+        total = self.aggregate(total=Sum(self.SUBTOTAL))['total']
+        return total if total is not None else 0
+
+    async def atotal_price(self):
+        total = (await self.aaggregate(total=Sum(self.SUBTOTAL)))['total']
+        return total if total is not None else 0
+
+    def add_quantity(self, cart_id, product_id, quantity):
+        """
+        Insert the line or bump its quantity in a single statement, so
+        concurrent adds of the same product never hit unique_together.
+        """
+        table = self.model._meta.db_table
+        # self.db would ask the router for a read database
+        connection = connections[self._db or router.db_for_write(self.model)]
+        if connection.vendor == 'mysql':
+            sql = (
+                f'INSERT INTO {table} (cart_id, product_id, quantity) VALUES (%s, %s, %s) '
+                'ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity)'
+            )
+        else:
+            sql = (
+                f'INSERT INTO {table} (cart_id, product_id, quantity) VALUES (%s, %s, %s) '
+                f'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {table}.quantity + excluded.quantity'
+            )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [cart_id, product_id, quantity])
+
+
 class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -113,6 +315,8 @@ class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     quantity = models.PositiveSmallIntegerField()
 
+    objects = CartItemQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.quantity} x {self.product.title}"
     
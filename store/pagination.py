@@ -0,0 +1,103 @@
+import base64
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import Q, QuerySet
+from graphql import get_named_type
+from graphql.execution.collect_fields import collect_sub_fields
+from strawberry_django.optimizer import OptimizerStore, optimize
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Columns products can be paged by; each has an index on (column, id)
+SORT_FIELDS = ('title', 'effective_price')
+
+
+def encode_cursor(product, sort: str = 'title') -> str:
+    # The sort is part of the cursor so it can't be replayed under another
+    raw = json.dumps([sort, str(getattr(product, sort)), product.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str, sort: str = 'title', model=None):
+    """Return the (sort value, id) of a cursor made for `sort`, parsed for `model`."""
+    try:
+        cursor_sort, value, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if cursor_sort != sort:
+            raise ValueError
+        if model is not None:
+            value = model._meta.get_field(sort).to_python(value)
+        return value, int(id)
+    except (ValueError, TypeError, ValidationError):
+        raise ValueError("Invalid cursor") from None
+
+
+def keyset_queryset(queryset: QuerySet, first: int = DEFAULT_PAGE_SIZE, after: str = None, sort: str = 'title'):
+    """
+    Queryset for one page of products ordered by (sort, id), with one extra
+    row to tell whether another page follows. Seeks past the cursor instead
+    of using OFFSET, so every page costs the same as the first one.
+    """
+    if first < 0:
+        raise ValueError("first must be a positive number")
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"Cannot sort products by {sort}")
+    first = min(first, MAX_PAGE_SIZE)
+
+    queryset = queryset.order_by(sort, 'id')
+    if after is not None:
+        value, id = decode_cursor(after, sort, queryset.model)
+        queryset = queryset.filter(Q(**{f'{sort}__gt': value}) | Q(**{sort: value, 'id__gt': id}))
+    return queryset[:first + 1], first
+
+
+def _connection(queryset: QuerySet, rows, first: int, sort: str):
+    from .types import PageInfo, ProductConnection, ProductEdge
+
+    edges = [ProductEdge(cursor=encode_cursor(product, sort), node=product) for product in rows[:first]]
+    return ProductConnection(
+        edges=edges,
+        page_info=PageInfo(
+            has_next_page=len(rows) > first,
+            end_cursor=edges[-1].cursor if edges else None,
+        ),
+        queryset=queryset,
+    )
+
+
+def _node_info(info, path):
+    """
+    Resolve info narrowed to the fields selected at `path` below the current
+    field (e.g. edges.node), or None when the client selected none of them.
+    """
+    info = getattr(info, '_raw_info', info)
+    field_nodes, parent_type = info.field_nodes, get_named_type(info.return_type)
+    for name in path:
+        fields = collect_sub_fields(info.schema, info.fragments, info.variable_values, parent_type, field_nodes)
+        field_nodes = [node for nodes in fields.values() for node in nodes if node.name.value == name]
+        if not field_nodes:
+            return None
+        info = info._replace(field_name=name, field_nodes=field_nodes, parent_type=parent_type,
+                             return_type=parent_type.fields[name].type)
+        parent_type = get_named_type(info.return_type)
+    return info
+
+
+def _page_queryset(queryset: QuerySet, info, path, sort: str):
+    # Load only what the nodes select (and the sort column the cursor needs)
+    node_info = _node_info(info, path) if info is not None else None
+    if node_info is None:
+        return queryset
+    return optimize(queryset, node_info, store=OptimizerStore.with_hints(only=[sort]))
+
+
+def product_connection(queryset: QuerySet, first: int = DEFAULT_PAGE_SIZE, after: str = None, sort: str = 'title',
+                       info=None, path=('edges', 'node')):
+    page, first = keyset_queryset(_page_queryset(queryset, info, path, sort), first, after, sort)
+    return _connection(queryset, list(page), first, sort)
+
+
+async def aproduct_connection(queryset: QuerySet, first: int = DEFAULT_PAGE_SIZE, after: str = None, sort: str = 'title',
+                              info=None, path=('edges', 'node')):
+    page, first = keyset_queryset(_page_queryset(queryset, info, path, sort), first, after, sort)
+    return _connection(queryset, [product async for product in page], first, sort)
@@ -0,0 +1,132 @@
+from django.db.models import Q
+from django.utils import timezone
+from tags.models import TaggedItem
+from .cache import invalidate
+from .models import Product, Promotion
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _chunked_ids(queryset, batch_size):
+    # Keyset over the primary key, so each chunk is a short index range scan
+    last_id = 0
+    while True:
+        ids = list(
+            queryset.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def target_products(promotion):
+    targets = list(promotion.targets.all())
+    if not targets:
+        return Product.objects.none()
+
+    q = Q()
+    for target in targets:
+        if target.collection_id:
+            q |= Q(collection_id=target.collection_id)
+        if target.brand:
+            q |= Q(brand=target.brand)
+        if target.tag_id:
+            q |= Q(pk__in=TaggedItem.objects.filter(
+                content_type__app_label='store',
+                content_type__model='product',
+                tag_id=target.tag_id,
+            ).values('object_id'))
+    return Product.objects.filter(q)
+
+
+def _update_in_batches(queryset, promotion, batch_size):
+    # Every chunk is its own short autocommit UPDATE instead of one long
+    # statement holding locks on the whole store_product table
+    updated = 0
+    for ids in _chunked_ids(queryset, batch_size):
+        updated += Product.objects.filter(pk__in=ids).set_promotion(promotion)
+    if updated:
+        invalidate('catalog')
+    return updated
+
+
+def _restore_in_batches(queryset, exclude, batch_size):
+    # Products get their best remaining active promotion: every chunk is
+    # cleared, then each promotion is applied from the smallest discount up
+    # so the largest one that targets a product is written last
+    others = [
+        (other, target_products(other))
+        for other in Promotion.objects.filter(status=Promotion.STATUS_ACTIVE).exclude(pk=exclude.pk).order_by('discount', 'pk')
+    ]
+    updated = 0
+    for ids in _chunked_ids(queryset, batch_size):
+        updated += Product.objects.filter(pk__in=ids).set_promotion(None)
+        for other, targets in others:
+            targets.filter(pk__in=ids).set_promotion(other)
+    if updated:
+        invalidate('catalog')
+    return updated
+
+
+def apply_promotion(promotion, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Attach the promotion to its target products and activate it. Products
+    already on a larger active promotion keep theirs.
+    """
+    products = target_products(promotion).exclude(
+        promotion__status=Promotion.STATUS_ACTIVE, promotion__discount__gt=promotion.discount,
+    )
+    updated = _update_in_batches(products, promotion, batch_size)
+    Promotion.objects.filter(pk=promotion.pk).update(status=Promotion.STATUS_ACTIVE)
+    promotion.status = Promotion.STATUS_ACTIVE
+    return updated
+
+
+def reprice_promotion(promotion, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Recompute sale prices of the promotion's products after an edit. A
+    promotion moved back to scheduled hands them to their best other one.
+    """
+    if promotion.status == Promotion.STATUS_SCHEDULED:
+        return _restore_in_batches(Product.objects.filter(promotion=promotion), promotion, batch_size)
+    return _update_in_batches(Product.objects.filter(promotion=promotion), promotion, batch_size)
+
+
+def expire_promotion(promotion, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Detach the promotion from every product still carrying it. Products it
+    overlapped with another active promotion get that one back.
+    """
+    updated = _restore_in_batches(Product.objects.filter(promotion=promotion), promotion, batch_size)
+    Promotion.objects.filter(pk=promotion.pk).update(status=Promotion.STATUS_EXPIRED)
+    promotion.status = Promotion.STATUS_EXPIRED
+    return updated
+
+
+def sweep_promotions(now=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Start scheduled promotions whose start time has passed and expire active
+    ones whose end time has passed. Meant to run every minute or so.
+    Returns the number of (started, expired) promotions.
+    """
+    now = now or timezone.now()
+    due = Promotion.objects.filter(
+        Q(starts_at__isnull=True) | Q(starts_at__lte=now),
+        Q(ends_at__isnull=True) | Q(ends_at__gt=now),
+        status=Promotion.STATUS_SCHEDULED,
+    )
+    expired = Promotion.objects.filter(
+        ends_at__lte=now,
+        status__in=[Promotion.STATUS_SCHEDULED, Promotion.STATUS_ACTIVE],
+    )
+
+    started_count = 0
+    for promotion in due:
+        apply_promotion(promotion, batch_size)
+        started_count += 1
+    expired_count = 0
+    for promotion in expired:
+        expire_promotion(promotion, batch_size)
+        expired_count += 1
+    return started_count, expired_count
@@ -0,0 +1,192 @@
+"""
+Per-request SQL accounting: query count and DB time per request and per
+GraphQL field, repeated query shapes (N+1) and a configurable budget.
+
+Every connection gets an execute wrapper (installed on connection_created)
+that is a no-op unless a tracking block is active, so the overhead outside
+tracked requests is one context variable lookup per query.
+"""
+import logging
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger(__name__)
+
+MODE_OFF = 'off'
+MODE_LOG = 'log'
+MODE_RAISE = 'raise'
+
+DEFAULT_BUDGET = {
+    'MODE': MODE_LOG,
+    'MAX_QUERIES': 50,
+    # Seconds of DB time per request
+    'MAX_DB_TIME': 1.0,
+    # Runs of one query shape that count as N+1
+    'REPEATED_QUERY_THRESHOLD': 10,
+}
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RepeatedQueryDetected(QueryBudgetExceeded):
+    pass
+
+
+def get_budget():
+    return {**DEFAULT_BUDGET, **getattr(settings, 'SQL_QUERY_BUDGET', {})}
+
+
+def query_shape(sql):
+    # Parameters are already placeholders; only IN lists vary in length
+    return IN_LIST_RE.sub('IN (...)', sql)
+
+
+class QueryStats:
+    def __init__(self, label, budget):
+        self.label = label
+        self.budget = budget
+        self.queries = 0
+        self.time = 0.0
+        self.shapes = Counter()
+        # field -> [queries, seconds]
+        self.fields = defaultdict(lambda: [0, 0.0])
+        # shape -> field that repeated it
+        self.repeated = {}
+
+    def record(self, sql, duration, field):
+        self.queries += 1
+        self.time += duration
+        totals = self.fields[field or '-']
+        totals[0] += 1
+        totals[1] += duration
+        shape = query_shape(sql)
+        self.shapes[shape] += 1
+        if self.shapes[shape] == self.budget['REPEATED_QUERY_THRESHOLD']:
+            self.repeated[shape] = field or '-'
+            if self.budget['MODE'] == MODE_RAISE:
+                raise RepeatedQueryDetected(
+                    f'{self.label}: query repeated {self.shapes[shape]} times in {field or "-"} '
+                    f'(likely N+1): {shape[:200]}'
+                )
+        if self.queries > self.budget['MAX_QUERIES'] and self.budget['MODE'] == MODE_RAISE:
+            raise QueryBudgetExceeded(
+                f'{self.label}: more than {self.budget["MAX_QUERIES"]} queries'
+            )
+
+    def problems(self):
+        problems = []
+        if self.queries > self.budget['MAX_QUERIES']:
+            problems.append(f'{self.queries} queries (budget {self.budget["MAX_QUERIES"]})')
+        if self.time > self.budget['MAX_DB_TIME']:
+            problems.append(f'{self.time * 1000:.0f}ms in the database (budget {self.budget["MAX_DB_TIME"] * 1000:.0f}ms)')
+        for shape, field in self.repeated.items():
+            problems.append(f'{self.shapes[shape]}x in {field}: {shape[:200]}')
+        return problems
+
+    def field_summary(self):
+        return {field: {'queries': count, 'time': seconds} for field, (count, seconds) in self.fields.items()}
+
+    def check(self):
+        problems = self.problems()
+        if not problems:
+            return
+        if self.budget['MODE'] == MODE_RAISE:
+            raise QueryBudgetExceeded(f'{self.label}: ' + '; '.join(problems))
+        fields = ', '.join(
+            f'{field}={count}' for field, (count, _) in sorted(self.fields.items(), key=lambda item: -item[1][0])
+        )
+        logger.warning('%s over SQL budget: %s [by field: %s]', self.label, '; '.join(problems), fields)
+
+
+_stats = ContextVar('sql_query_stats', default=None)
+_field = ContextVar('sql_query_field', default=None)
+
+
+def current_stats():
+    return _stats.get()
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record(sql, time.perf_counter() - started, _field.get())
+
+
+def install(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def track(label, check=True):
+    """
+    Count queries run inside the block. Nested blocks share the outer
+    stats, so a GraphQL operation inside a tracked request adds to it.
+    """
+    budget = get_budget()
+    if budget['MODE'] == MODE_OFF or _stats.get() is not None:
+        yield _stats.get()
+        return
+    stats = QueryStats(label, budget)
+    token = _stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _stats.reset(token)
+    if check:
+        stats.check()
+
+
+def enter_field(name):
+    """
+    Attribute the following queries to a GraphQL field. Not reset on
+    return: lazy querysets are evaluated after the resolver returns but
+    before the next field starts, so they still land on this field.
+    """
+    _field.set(name)
+
+
+@contextmanager
+def fields():
+    """Scope enter_field() calls to the block."""
+    token = _field.set(None)
+    try:
+        yield
+    finally:
+        _field.reset(token)
+
+
+def _finish(stats, response):
+    if stats is not None:
+        response['Server-Timing'] = f'db;dur={stats.time * 1000:.1f};desc="{stats.queries} queries"'
+    return response
+
+
+@sync_and_async_middleware
+def QueryBudgetMiddleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            with track(f'{request.method} {request.path}') as stats:
+                response = await get_response(request)
+            return _finish(stats, response)
+    else:
+        def middleware(request):
+            with track(f'{request.method} {request.path}') as stats:
+                response = get_response(request)
+            return _finish(stats, response)
+    return middleware
@@ -1,11 +1,19 @@
 import strawberry
-from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+from typing import NewType
+from django.core.files.uploadedfile import UploadedFile
 
-@strawberry.scalar(
-    name="Upload",
-    description="Represents an uploaded file"
-)
-def Upload(value) -> InMemoryUploadedFile:
-    if isinstance(value, (InMemoryUploadedFile, TemporaryUploadedFile)):
+
+def parse_upload(value):
+    if isinstance(value, UploadedFile):
         return value
     raise ValueError("Invalid file upload")
+
+
+# Filled in from the multipart request (GraphQL multipart request spec)
+Upload = strawberry.scalar(
+    NewType("Upload", UploadedFile),
+    name="Upload",
+    description="Represents an uploaded file",
+    serialize=lambda value: value.name,
+    parse_value=parse_upload,
+)
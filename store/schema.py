@@ -1,8 +1,16 @@
 import strawberry
 from strawberry.types import Info
+from strawberry.extensions import ParserCache, QueryDepthLimiter, ValidationCache
 from typing import List, Optional
-from .models import Product, Collection, Promotion, Cart, CartItem
-from .types import ProductType, CartItemType, CartType, CartItemInput, UserType, CollectionType
+from .models import Product, Collection, Promotion, Cart, CartItem, Order
+from .types import ProductType, CartItemType, CartType, CartItemInput, UserType, CollectionType, ProductConnection, ProductSearchFilter
+from .types import ProductFacetFilter, Facet, FacetValue, FilteredProducts, OrderType, ProductSort
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, aproduct_connection, product_connection
+from .search import search_product_ids
+from .facets import facet_counts, filter_products
+from .checkout import checkout
+from tags.models import TaggedItem
+from .images import save_upload
 from .scalars import Upload
 from django.core.exceptions import ObjectDoesNotExist
 from django.shortcuts import get_object_or_404
@@ -10,43 +18,192 @@ from django.contrib.auth.models import User
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 from django.contrib.auth import authenticate, login
+from django.db import IntegrityError, transaction
+from strawberry.utils.inspect import in_async_context
+from strawberry_django.optimizer import DjangoOptimizerExtension, optimize
+from django.conf import settings
+from .extensions import CatalogCacheExtension, QueryCostExtension, QueryStatsExtension, ReplicaReadExtension, TracingExtension
 
 
 
+def _limit(queryset, limit: Optional[int]):
+    # Unpaginated lists return every row unless the client asks for fewer;
+    # QueryCostExtension rejects requests that would be too large
+    if limit is None:
+        return queryset
+    if limit < 0:
+        raise ValueError("limit must be a positive number")
+    if not queryset.ordered:
+        queryset = queryset.order_by('pk')
+    return queryset[:limit]
+
+
+def _apply_cart_items(cart_id: int, items: List[CartItemInput], replace: bool):
+    """
+    Add (or with replace=True, set) every line of a cart in one transaction
+    using bulk_create/bulk_update instead of one addToCart per product.
+    """
+    quantities = {}
+    for item in items:
+        if item.quantity < 0 or (item.quantity == 0 and not replace):
+            raise ValueError("Quantity must be positive")
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+
+    found = set(Product.objects.filter(pk__in=quantities).order_by().values_list('pk', flat=True))
+    missing = set(quantities) - found
+    if missing:
+        raise ValueError(f"Product not found: {', '.join(map(str, sorted(missing)))}")
+
+    with transaction.atomic():
+        # Locking the cart row serializes concurrent bulk updates of one cart
+        try:
+            cart = Cart.objects.select_for_update().get(pk=cart_id)
+        except Cart.DoesNotExist:
+            raise ValueError("Cart not found")
+
+        existing = {item.product_id: item for item in cart.items.all()}
+        to_update = []
+        to_create = []
+        for product_id, quantity in quantities.items():
+            item = existing.get(product_id)
+            if item is None:
+                if quantity > 0:
+                    to_create.append(CartItem(cart=cart, product_id=product_id, quantity=quantity))
+            elif replace and quantity == 0:
+                continue
+            else:
+                item.quantity = quantity if replace else item.quantity + quantity
+                to_update.append(item)
+
+        if replace:
+            keep = [item.pk for item in to_update]
+            cart.items.exclude(pk__in=keep).delete()
+        CartItem.objects.bulk_update(to_update, ['quantity'])
+        CartItem.objects.bulk_create(to_create)
+
+
+async def _aget_cart(queryset):
+    try:
+        return await queryset.aget()
+    except Cart.DoesNotExist:
+        raise Exception("Cart not found")
+
+
 #Query[Get - Read]
 @strawberry.type
 class Query: 
     @strawberry.field
     def get_user(self, id: strawberry.ID) -> UserType:
+        if in_async_context():
+            return User.objects.aget(id=id)
         return User.objects.get(id=id)
     
     @strawberry.field
-    def get_users(self) -> List[UserType]:
-        return User.objects.all()
+    def get_users(self, limit: Optional[int] = None) -> List[UserType]:
+        return _limit(User.objects.all(), limit)
 
     @strawberry.field
-    def get_products(self) -> List[ProductType]:
-        return Product.objects.all()
+    def get_products(self, limit: Optional[int] = None) -> List[ProductType]:
+        return _limit(Product.objects.all(), limit)
     
     @strawberry.field
-    def get_product(self, id: int) -> Optional[ProductType]:
-        try:
-            return Product.objects.get(pk=id)
-        except Product.DoesNotExist:
-            return None
+    def get_product(self, info: Info, id: int) -> Optional[ProductType]:
+        queryset = optimize(Product.objects.filter(pk=id), info)
+        if in_async_context():
+            return queryset.afirst()
+        return queryset.first()
         
     @strawberry.field
     def get_collections(self) -> List[CollectionType]:
         return Collection.objects.all()
     
     @strawberry.field
-    def get_collection_products(self, title: str) -> List[ProductType]:
-        return Product.objects.filter(collection__title=title)
+    def get_collection_products(self, title: str, limit: Optional[int] = None) -> List[ProductType]:
+        return _limit(Product.objects.filter(collection__title=title), limit)
     
     @strawberry.field
-    def get_cart(self, id: int) -> CartType:
+    def get_products_connection(
+        self,
+        info: Info,
+        first: int = DEFAULT_PAGE_SIZE,
+        after: Optional[str] = None,
+        sort: ProductSort = ProductSort.TITLE) -> ProductConnection:
+        if in_async_context():
+            return aproduct_connection(Product.objects.all(), first, after, sort.value, info)
+        return product_connection(Product.objects.all(), first, after, sort.value, info)
+
+    @strawberry.field
+    def get_collection_products_connection(
+        self,
+        info: Info,
+        title: str,
+        first: int = DEFAULT_PAGE_SIZE,
+        after: Optional[str] = None,
+        sort: ProductSort = ProductSort.TITLE) -> ProductConnection:
+        queryset = Product.objects.filter(collection__title=title)
+        if in_async_context():
+            return aproduct_connection(queryset, first, after, sort.value, info)
+        return product_connection(queryset, first, after, sort.value, info)
+
+    # Resolving the content type may query, so this runs off the event loop too
+    @strawberry.django.field
+    def products_by_tags(
+        self,
+        info: Info,
+        labels: List[str],
+        match_all: bool = False,
+        first: int = DEFAULT_PAGE_SIZE,
+        after: Optional[str] = None,
+        sort: ProductSort = ProductSort.TITLE) -> ProductConnection:
+        queryset = Product.objects.filter(
+            pk__in=TaggedItem.objects.object_ids_tagged(Product, labels, match_all)
+        )
+        return product_connection(queryset, first, after, sort.value, info)
+
+    # Search and facets run several queries; strawberry.django.field moves
+    # them off the event loop when served by the async view
+    @strawberry.django.field
+    def search_products(
+        self,
+        info: Info,
+        query: str,
+        filters: Optional[ProductSearchFilter] = None,
+        limit: int = DEFAULT_PAGE_SIZE) -> List[ProductType]:
+        ids = search_product_ids(
+            query,
+            filters.to_lookups() if filters else None,
+            limit=min(limit, MAX_PAGE_SIZE),
+        )
+        products = optimize(Product.objects.filter(pk__in=ids), info).in_bulk()
+        return [products[id] for id in ids if id in products]
+
+    @strawberry.django.field
+    def filter_products(
+        self,
+        info: Info,
+        filters: Optional[ProductFacetFilter] = None,
+        first: int = DEFAULT_PAGE_SIZE,
+        after: Optional[str] = None,
+        sort: ProductSort = ProductSort.TITLE) -> FilteredProducts:
+        selection = filters.to_selection() if filters else {}
+        facets = [
+            Facet(name=name, values=[FacetValue(value=value, count=count) for value, count in values])
+            for name, values in facet_counts(selection).items()
+        ]
+        return FilteredProducts(
+            products=product_connection(
+                filter_products(selection), first, after, sort.value, info, ('products', 'edges', 'node'),
+            ),
+            facets=facets,
+        )
+
+    @strawberry.field
+    def get_cart(self, info: Info, id: int) -> CartType:
+        queryset = optimize(Cart.objects.filter(id=id), info)
+        if in_async_context():
+            return _aget_cart(queryset)
         try:
-            return Cart.objects.prefetch_related("items").get(id=id)  
+            return queryset.get()
         except Cart.DoesNotExist:
             raise Exception("Cart not found")
         
@@ -56,7 +213,7 @@ class Query:
 #Mutation[Create - Update - Delete]
 @strawberry.type
 class Mutation:
-    @strawberry.mutation
+    @strawberry.django.mutation
     def register(
         self, 
         first_name: str, 
@@ -79,7 +236,7 @@ class Mutation:
 
         return UserType(id=user.id, first_name=user.first_name, last_name=user.last_name, email=user.email)
 
-    @strawberry.mutation
+    @strawberry.django.mutation
     def login(self, email: str, password: str) -> UserType:
         user = authenticate(username=email, password=password)
         
@@ -88,10 +245,9 @@ class Mutation:
 
         return UserType(id=user.id, first_name=user.first_name, last_name=user.last_name, email=user.email)
 
-    @strawberry.mutation
+    @strawberry.django.mutation
     def add_product(
         self, 
-        image: str, 
         title: str, 
         brand: str,
         model: str,
@@ -103,7 +259,8 @@ class Mutation:
         price: float, 
         inventory: int, 
         collection_title: str, 
-        discount: Optional[int] = None) -> ProductType:
+        discount: Optional[int] = None,
+        image: Optional[Upload] = None) -> ProductType:
         try:
             collection = Collection.objects.get(title=collection_title)
         except ObjectDoesNotExist:
@@ -117,7 +274,7 @@ class Mutation:
                 promotion = Promotion.objects.create(discount=discount)
         
         product = Product.objects.create(
-            image=image,
+            image=save_upload(image) if image else None,
             title=title,
             brand=brand,
             model=model,
@@ -133,11 +290,11 @@ class Mutation:
         )
         return product
 
-    @strawberry.mutation
+    @strawberry.django.mutation
     def update_product(
         self,
         id: int,
-        image: Optional[str] = None,
+        image: Optional[Upload] = None,
         title: Optional[str] = None,
         brand: Optional[str] = None,
         model: Optional[str] = None,
@@ -152,7 +309,7 @@ class Mutation:
         product = Product.objects.get(id=id)
         
         if image is not None:
-            product.image = image
+            product.image = save_upload(image)
         if title is not None:
             product.title = title
         if brand is not None:
@@ -177,35 +334,19 @@ class Mutation:
         product.save()
         return product
     
-    @strawberry.mutation
+    @strawberry.django.mutation
     def delete_product(self, id: int) -> Optional[ProductType]:
         try:
-            product = Product.objects.get(id=id)
-
-            deleted_product = ProductType(
-                id=product.id,
-                image=product.image.url if product.image else None,
-                title=product.title,
-                brand=product.brand,
-                model=product.model,
-                color=product.color,
-                slug=product.slug,
-                popular=product.popular,
-                rating=product.rating,
-                description=product.description,
-                price=product.price,
-                inventory=product.inventory,
-                collection=product.collection,  
-                promotion=product.promotion
-            )
-
+            product = Product.objects.select_related('collection', 'promotion').get(id=id)
             product.delete()
-            return deleted_product  
+            # delete() clears the primary key; return what was deleted
+            product.id = id
+            return product
 
         except ObjectDoesNotExist:
             return None  
         
-    @strawberry.mutation
+    @strawberry.django.mutation
     def create_cart(self) -> CartType:
         cart = Cart.objects.create()
         return cart
@@ -220,29 +361,40 @@ class Mutation:
             raise Exception(f"Cart with id {id} does not exist")
         
     @strawberry.django.mutation
-    def add_to_cart(info, cart_id: int, item_data: CartItemInput) -> CartType:
+    def add_to_cart(self, info: Info, cart_id: int, item_data: CartItemInput) -> CartType:
+        if item_data.quantity < 1:
+            raise ValueError("Quantity must be positive")
+        # Foreign keys may only be checked at commit (PostgreSQL, SQLite), so
+        # an unknown product is caught here rather than by the upsert
+        if not Product.objects.filter(pk=item_data.product_id).exists():
+            raise ValueError("Product not found")
+
         try:
-            cart = Cart.objects.get(pk=cart_id)
-        except Cart.DoesNotExist:
-            raise ValueError("Cart not found")
+            with transaction.atomic():
+                # The cart lock addItemsToCart and setCartItems take, so their
+                # read-then-write of the cart's lines can't interleave with this
+                if not Cart.objects.select_for_update().filter(pk=cart_id).exists():
+                    raise ValueError("Cart not found")
+                CartItem.objects.add_quantity(cart_id, item_data.product_id, item_data.quantity)
+        except IntegrityError:
+            raise ValueError("Product not found")
 
-        product = Product.objects.get(pk=item_data.product_id)
+        return optimize(Cart.objects.filter(pk=cart_id), info).get()
 
-        existing_item = cart.items.filter(product=product).first()
+    @strawberry.django.mutation
+    def checkout(self, info: Info, cart_id: int, customer_id: int) -> OrderType:
+        order = checkout(cart_id, customer_id)
+        return optimize(Order.objects.filter(pk=order.pk), info).get()
 
-        if existing_item:
-            existing_item.quantity += item_data.quantity
-            existing_item.save()
-        else:
-            cart_item = CartItem(
-                cart=cart,
-                product=product,
-                quantity=item_data.quantity,
-            )
-            cart_item.save()
+    @strawberry.django.mutation
+    def add_items_to_cart(self, info: Info, cart_id: int, items: List[CartItemInput]) -> CartType:
+        _apply_cart_items(cart_id, items, replace=False)
+        return optimize(Cart.objects.filter(pk=cart_id), info).get()
 
-        cart.refresh_from_db() 
-        return cart
+    @strawberry.django.mutation
+    def set_cart_items(self, info: Info, cart_id: int, items: List[CartItemInput]) -> CartType:
+        _apply_cart_items(cart_id, items, replace=True)
+        return optimize(Cart.objects.filter(pk=cart_id), info).get()
         
 
     
@@ -253,4 +405,19 @@ class Mutation:
 
     
 
-schema = strawberry.Schema(query=Query, mutation=Mutation)
\ No newline at end of file
+schema = strawberry.Schema(
+    query=Query,
+    mutation=Mutation,
+    extensions=[
+        QueryStatsExtension,
+        TracingExtension,
+        ParserCache(maxsize=256),
+        ValidationCache(maxsize=256),
+        QueryDepthLimiter(max_depth=settings.GRAPHQL_MAX_QUERY_DEPTH),
+        QueryCostExtension,
+        # Inside the replica block, so the cache can tell replica reads apart
+        ReplicaReadExtension,
+        CatalogCacheExtension,
+        DjangoOptimizerExtension,
+    ],
+)
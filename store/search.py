@@ -0,0 +1,160 @@
+import re
+from django.db.models import Case, F, FloatField, Max, Value, When
+from django.db.models.functions import Length
+from .models import Product, ProductSearchTerm
+
+FIELD_WEIGHTS = {
+    'title': 8,
+    'brand': 5,
+    'model': 5,
+    'color': 3,
+    'description': 1,
+}
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.6
+TYPO_SCORE = 0.4
+MIN_TYPO_LENGTH = 4
+# Shorter words only match exactly; a one or two letter prefix matches
+# too much of the vocabulary to be useful
+MIN_PREFIX_LENGTH = 3
+# Most prefix and typo expansions per word, keeping the scoring CASE small
+MAX_EXPANSIONS = 50
+MAX_TYPO_CANDIDATES = 1000
+MAX_TERM_LENGTH = ProductSearchTerm._meta.get_field('term').max_length
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(text.lower())]
+
+
+def product_terms(product):
+    weights = {}
+    for field, weight in FIELD_WEIGHTS.items():
+        for token in set(tokenize(getattr(product, field))):
+            weights[token] = weights.get(token, 0) + weight
+    return weights
+
+
+def index_product(product):
+    ProductSearchTerm.objects.filter(product=product).delete()
+    ProductSearchTerm.objects.bulk_create(
+        ProductSearchTerm(term=term, product=product, weight=weight)
+        for term, weight in product_terms(product).items()
+    )
+
+
+def index_products(products):
+    """Reindex many products with one DELETE and one bulk INSERT."""
+    ProductSearchTerm.objects.filter(product__in=[product.pk for product in products]).delete()
+    ProductSearchTerm.objects.bulk_create(
+        ProductSearchTerm(term=term, product_id=product.pk, weight=weight)
+        for product in products
+        for term, weight in product_terms(product).items()
+    )
+
+
+def rebuild_index(batch_size=1000):
+    ProductSearchTerm.objects.all().delete()
+    rows = []
+    fields = ['id', *FIELD_WEIGHTS]
+    for product in Product.objects.only(*fields).order_by().iterator(chunk_size=batch_size):
+        rows.extend(
+            ProductSearchTerm(term=term, product_id=product.id, weight=weight)
+            for term, weight in product_terms(product).items()
+        )
+        if len(rows) >= batch_size:
+            ProductSearchTerm.objects.bulk_create(rows)
+            rows = []
+    ProductSearchTerm.objects.bulk_create(rows)
+
+
+def _within_one_edit(a, b):
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = j = edits = 0
+    while i < len(a) and j < len(b):
+        if a[i] != b[j]:
+            edits += 1
+            if edits > 1:
+                return False
+            if len(a) == len(b):
+                i += 1
+            j += 1
+        else:
+            i += 1
+            j += 1
+    return edits + (len(b) - j) <= 1
+
+
+def _matching_terms(token):
+    """
+    Map every indexed term that can stand for `token` to its score factor:
+    the exact word, up to MAX_EXPANSIONS words it is a prefix of, and words
+    one edit away.
+    """
+    matches = {token: EXACT_SCORE}
+    if len(token) < MIN_PREFIX_LENGTH:
+        return matches
+    terms = ProductSearchTerm.objects.values_list('term', flat=True).distinct()
+    prefixed = terms.filter(term__startswith=token).exclude(term=token).order_by('term')
+    for term in prefixed[:MAX_EXPANSIONS]:
+        matches[term] = PREFIX_SCORE
+
+    if len(token) >= MIN_TYPO_LENGTH:
+        # Typos rarely hit the first two letters; this keeps the scan small
+        candidates = (
+            terms.annotate(length=Length('term'))
+            .filter(term__startswith=token[:2], length__range=(len(token) - 1, len(token) + 1))
+            .order_by('term')
+        )
+        typos = 0
+        for term in candidates[:MAX_TYPO_CANDIDATES]:
+            if term not in matches and _within_one_edit(token, term):
+                matches[term] = TYPO_SCORE
+                typos += 1
+                if typos >= MAX_EXPANSIONS:
+                    break
+    return matches
+
+
+def search_product_ids(query, filters=None, limit=20):
+    """
+    Return ids of products matching every word of `query`, best match first.
+    `filters` is a dict of Product lookups, e.g. {'brand': 'Apple'}.
+    """
+    tokens = list(dict.fromkeys(tokenize(query)))
+    if not tokens:
+        return []
+
+    all_terms = set()
+    scores = {}
+    for i, token in enumerate(tokens):
+        matches = _matching_terms(token)
+        all_terms.update(matches)
+        scores[f'token_{i}'] = Max(
+            Case(
+                *[When(term=term, then=F('weight') * Value(factor)) for term, factor in matches.items()],
+                default=Value(0.0),
+                output_field=FloatField(),
+            )
+        )
+
+    queryset = ProductSearchTerm.objects.filter(term__in=all_terms)
+    if filters:
+        queryset = queryset.filter(**{f'product__{key}': value for key, value in filters.items()})
+
+    score = sum((F(name) for name in scores), Value(0.0))
+    queryset = (
+        queryset.values('product_id')
+        .annotate(**scores)
+        .filter(**{f'{name}__gt': 0 for name in scores})
+        .annotate(score=score)
+        .order_by('-score', 'product_id')
+    )
+    return [row['product_id'] for row in queryset[:limit]]
@@ -0,0 +1,58 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.contrib.contenttypes.models import ContentType
+from django.dispatch import receiver
+from tags.models import Tag, TaggedItem
+from .models import Collection, Product, Promotion
+from . import cache, images, promotions, querystats, search
+
+
+@receiver(connection_created)
+def track_queries(sender, connection, **kwargs):
+    querystats.install(connection)
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, **kwargs):
+    # Index rows are removed with the product through the foreign key cascade
+    search.index_product(instance)
+
+
+@receiver(post_save, sender=Product)
+def schedule_image_variants(sender, instance, **kwargs):
+    if instance.image and instance.image.name != getattr(instance, '_loaded_image', None):
+        images.schedule_variants(instance.pk)
+        instance._loaded_image = instance.image.name
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    cache.invalidate('product', f'product:{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=TaggedItem)
+def invalidate_product_tags(sender, instance, **kwargs):
+    if instance.content_type_id == ContentType.objects.get_for_model(Product).id:
+        cache.invalidate('product', f'product:{instance.object_id}')
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tag(sender, instance, **kwargs):
+    # Any product may carry the tag, and its label is part of their responses
+    cache.invalidate('product')
+
+
+@receiver([post_save, post_delete], sender=Collection)
+def invalidate_collection(sender, instance, **kwargs):
+    cache.invalidate('collection')
+
+
+@receiver(post_save, sender=Promotion)
+def refresh_promotion_prices(sender, instance, created, **kwargs):
+    if not created:
+        promotions.reprice_promotion(instance)
+
+
+@receiver([post_save, post_delete], sender=Promotion)
+def invalidate_promotion(sender, instance, **kwargs):
+    cache.invalidate('promotion')
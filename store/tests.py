@@ -1,3 +1,1283 @@
-from django.test import TestCase
+import base64
+import csv
+import hashlib
+import io
+import json
+import re
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopUpload
+from django.core.files.storage import default_storage
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from storefront import routers
+from storefront.db.pool import ConnectionPool, PoolTimeout
+from . import benchmark, cache, export, images, importer, metrics, promotions, querystats
+from .checkout import checkout
+from tags.models import Tag, TaggedItem
+from .models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, Promotion, PromotionTarget
+from .pagination import encode_cursor, keyset_queryset
+from .search import MAX_EXPANSIONS, _matching_terms, rebuild_index, search_product_ids
+from .schema import schema
+from .views import AsyncPersistedQueryGraphQLView
 
-# Create your tests here.
+SQLITE_FULL_SCAN = re.compile(r'\bSCAN (\w+)\b(?! USING)')
+POSTGRES_FULL_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def full_scans(queryset):
+    """Tables the query plan reads without an index."""
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        return SQLITE_FULL_SCAN.findall(queryset.explain())
+    if vendor == 'mysql':
+        plan = queryset.explain(format='json')
+        return [
+            table['table_name']
+            for table in _mysql_tables(json.loads(plan))
+            if table.get('access_type') == 'ALL'
+        ]
+    if vendor == 'postgresql':
+        return POSTGRES_FULL_SCAN.findall(queryset.explain())
+    raise NotImplementedError(f'No plan checks for {vendor}')
+
+
+def _mysql_tables(node):
+    if isinstance(node, dict):
+        if 'table_name' in node and 'access_type' in node:
+            yield node
+        for value in node.values():
+            yield from _mysql_tables(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _mysql_tables(value)
+
+
+class HotQueryPlanTests(TestCase):
+    """
+    EXPLAIN every hot ORM query and fail if the plan falls back to a full
+    table scan, so a dropped or mismatched index shows up in CI.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        collections = Collection.objects.bulk_create(Collection(title=f'Collection {i}') for i in range(20))
+        promotions = Promotion.objects.bulk_create(Promotion(description='', discount=d) for d in (5, 10, 15, 20))
+        Product.objects.bulk_create(
+            Product(
+                title=f'Product {i:04}',
+                slug=f'product-{i}',
+                price=Decimal(10 + i % 90),
+                effective_price=Decimal(10 + i % 90),
+                inventory=10,
+                collection=collections[i % len(collections)],
+                promotion=promotions[i % len(promotions)] if i % 3 == 0 else None,
+            )
+            for i in range(1000)
+        )
+        customers = Customer.objects.bulk_create(
+            Customer(first_name='First', last_name=f'Last {i}', email=f'customer{i}@example.com', phone='0')
+            for i in range(100)
+        )
+        Order.objects.bulk_create(Order(customer=customers[i % len(customers)]) for i in range(1000))
+        tags = Tag.objects.bulk_create(Tag(label=f'tag-{i}') for i in range(50))
+        content_type = ContentType.objects.get_for_model(Product)
+        TaggedItem.objects.bulk_create(
+            TaggedItem(tag=tags[(product_id + offset) % len(tags)], content_type=content_type, object_id=product_id)
+            for product_id in Product.objects.values_list('id', flat=True)
+            for offset in (0, 7)
+        )
+
+        cls.collection = collections[0]
+        cls.product = Product.objects.order_by('id').first()
+        cls.customer = customers[0]
+
+        with connection.cursor() as cursor:
+            # Plans should reflect real table statistics, not empty-table guesses
+            if connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
+            elif connection.vendor == 'mysql':
+                for model in (Collection, Promotion, Product, Customer, Order, Tag, TaggedItem):
+                    cursor.execute(f'ANALYZE TABLE {model._meta.db_table}')
+            elif connection.vendor == 'postgresql':
+                cursor.execute('ANALYZE')
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # Small test tables are cheaper to seq scan; only report scans
+            # that have no usable index at all
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def assertUsesIndexes(self, queryset):
+        self.assertEqual(full_scans(queryset), [], queryset.explain())
+
+    def test_collection_products(self):
+        self.assertUsesIndexes(Product.objects.filter(collection__title=self.collection.title))
+
+    def test_promotion_by_discount(self):
+        self.assertUsesIndexes(Promotion.objects.filter(discount=10))
+
+    def test_products_by_title(self):
+        self.assertUsesIndexes(Product.objects.order_by('title', 'id')[:20])
+
+    def test_products_keyset_page(self):
+        for sort in ('title', 'effective_price'):
+            with self.subTest(sort=sort):
+                page, _ = keyset_queryset(Product.objects.all(), 20, encode_cursor(self.product, sort), sort)
+                self.assertUsesIndexes(page)
+
+    def test_collection_products_keyset_page(self):
+        queryset = Product.objects.filter(collection=self.collection)
+        page, _ = keyset_queryset(queryset, 20, encode_cursor(self.product, 'title'), 'title')
+        self.assertUsesIndexes(page)
+
+    def test_orders_by_placed_at(self):
+        self.assertUsesIndexes(Order.objects.order_by('placed_at')[:20])
+
+    def test_customer_orders(self):
+        self.assertUsesIndexes(Order.objects.filter(customer=self.customer).order_by('placed_at'))
+
+    def test_tags_for_product(self):
+        self.assertUsesIndexes(TaggedItem.objects.get_tags_for(Product, self.product.id))
+
+    def test_tags_for_products(self):
+        ids = list(Product.objects.order_by('id').values_list('id', flat=True)[:20])
+        self.assertUsesIndexes(
+            TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Product), object_id__in=ids)
+        )
+
+    def test_products_by_tags(self):
+        for match_all in (False, True):
+            with self.subTest(match_all=match_all):
+                ids = TaggedItem.objects.object_ids_tagged(Product, ['tag-1', 'tag-8'], match_all)
+                self.assertUsesIndexes(Product.objects.filter(pk__in=ids))
+
+
+@skipUnless(routers.replicas(), 'needs a replica database, e.g. a second SQLite file')
+class ReplicaRoutingTests(TestCase):
+    """
+    Run with DATABASES holding a primary and at least one replica; two
+    SQLite files are enough. Queries are counted per connection.
+    """
+    databases = set(settings.DATABASES)
+
+    def setUp(self):
+        self.replica = routers.replicas()[0]
+
+    def capture(self, alias):
+        return CaptureQueriesContext(connections[alias])
+
+    def test_reads_use_primary_outside_replica_blocks(self):
+        self.assertEqual(routers.ReplicaRouter().db_for_read(Product), routers.PRIMARY)
+
+    def test_graphql_query_reads_from_replica(self):
+        with self.capture(routers.PRIMARY) as primary, self.capture(self.replica) as replica:
+            result = schema.execute_sync('{ getCollections { title } }')
+        self.assertIsNone(result.errors)
+        self.assertEqual(len(primary), 0)
+        self.assertEqual(len(replica), 1)
+
+    def test_graphql_mutation_uses_primary(self):
+        with self.capture(self.replica) as replica:
+            result = schema.execute_sync('mutation { createCart { id } }')
+        self.assertIsNone(result.errors)
+        self.assertEqual(len(replica), 0)
+
+    def test_reads_after_write_stay_on_primary(self):
+        with routers.read_from_replica() as state:
+            router = routers.ReplicaRouter()
+            self.assertIn(router.db_for_read(Product), routers.replicas())
+            self.assertEqual(router.db_for_write(Product), routers.PRIMARY)
+            self.assertTrue(state.wrote)
+            self.assertEqual(router.db_for_read(Product), routers.PRIMARY)
+
+    def test_write_pins_client_to_primary(self):
+        def write(request):
+            routers.ReplicaRouter().db_for_write(Product)
+            return HttpResponse()
+
+        response = routers.ReplicaRoutingMiddleware(write)(RequestFactory().post('/graphql/'))
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        self.assertEqual(response.cookies[routers.PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+
+        request = RequestFactory().get('/graphql/')
+        request.COOKIES[routers.PIN_COOKIE] = '1'
+        reads = []
+
+        def view(request):
+            with routers.read_from_replica():
+                reads.append(routers.ReplicaRouter().db_for_read(Product))
+            return HttpResponse()
+
+        routers.ReplicaRoutingMiddleware(view)(request)
+        self.assertEqual(reads, [routers.PRIMARY])
+
+    def test_add_to_cart_pins_client_to_primary(self):
+        collection = Collection.objects.create(title='Phones')
+        product = Product.objects.create(title='Phone', slug='phone', price=10, inventory=5, collection=collection)
+        cart = Cart.objects.create()
+        results = []
+
+        def view(request):
+            results.append(schema.execute_sync(
+                'mutation ($cart: Int!, $product: Int!) '
+                '{ addToCart(cartId: $cart, itemData: {productId: $product, quantity: 1}) { id } }',
+                variable_values={'cart': cart.id, 'product': product.id},
+            ))
+            return HttpResponse()
+
+        response = routers.ReplicaRoutingMiddleware(view)(RequestFactory().post('/graphql/'))
+        self.assertIsNone(results[0].errors)
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        self.assertEqual(CartItem.objects.get(cart=cart).quantity, 1)
+
+    def test_replica_reads_after_invalidation_not_cached(self):
+        caches['catalog'].clear()
+        query = '{ getCollections { title } }'
+        cache.invalidate('collection')
+        self.assertIsNone(schema.execute_sync(query).errors)
+        with self.capture(self.replica) as replica:
+            schema.execute_sync(query)
+        self.assertEqual(len(replica), 1)
+
+        caches['catalog'].delete('invalidated:collection')
+        schema.execute_sync(query)
+        with self.capture(self.replica) as replica:
+            schema.execute_sync(query)
+        self.assertEqual(len(replica), 0)
+
+    def test_admin_changelist_reads_from_replica(self):
+        reads = []
+
+        def view(request):
+            reads.append(routers.ReplicaRouter().db_for_read(Product))
+            return HttpResponse()
+
+        middleware = routers.ReplicaRoutingMiddleware(view)
+        middleware(RequestFactory().get('/admin/store/product/'))
+        middleware(RequestFactory().get('/admin/store/product/1/change/'))
+        self.assertIn(reads[0], routers.replicas())
+        self.assertEqual(reads[1], routers.PRIMARY)
+
+
+@override_settings(
+    SQL_QUERY_BUDGET={'MODE': 'raise', 'MAX_QUERIES': 20, 'REPEATED_QUERY_THRESHOLD': 5},
+    # The fixtures live on the primary only when a replica is configured
+    DATABASE_ROUTERS=[],
+)
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Phones')
+        products = Product.objects.bulk_create(
+            Product(title=f'Phone {i}', slug=f'phone-{i}', price=10, effective_price=10, inventory=5, collection=collection)
+            for i in range(10)
+        )
+        cls.cart = Cart.objects.create()
+        CartItem.objects.bulk_create(CartItem(cart=cls.cart, product=product, quantity=1) for product in products)
+
+    def test_repeated_queries_fail(self):
+        with self.assertRaises(querystats.RepeatedQueryDetected):
+            with querystats.track('test'):
+                for item in CartItem.objects.filter(cart=self.cart):
+                    item.product.title
+
+    def test_cart_stays_within_budget(self):
+        with querystats.track('test') as stats:
+            result = schema.execute_sync(
+                'query ($id: Int!) { getCart(id: $id) { totalPrice items { productName productPrice subtotal } } }',
+                variable_values={'id': self.cart.id},
+            )
+        self.assertIsNone(result.errors)
+        self.assertEqual(stats.repeated, {})
+        self.assertLessEqual(stats.queries, 3)
+
+    @override_settings(DEBUG=True)
+    def test_debug_reports_operation_queries(self):
+        result = schema.execute_sync('{ getCollections { title } getUsers { id } }')
+        self.assertIsNone(result.errors)
+        sql = result.extensions['sql']
+        self.assertEqual(sql['queries'], 2)
+        self.assertEqual(set(sql['fields']), {'Query.getCollections', 'Query.getUsers'})
+
+    @override_settings(SQL_QUERY_BUDGET={'MODE': 'log', 'MAX_QUERIES': 1})
+    def test_log_mode_only_warns(self):
+        with self.assertLogs('store.querystats', 'WARNING'):
+            with querystats.track('test'):
+                list(Product.objects.all())
+                list(Collection.objects.all())
+
+
+@override_settings(DATABASE_ROUTERS=[], GRAPHQL_TRACE_FILE='')
+class MetricsTests(TestCase):
+    def series(self, metric, **labels):
+        return metric._series.get(tuple(labels[name] for name in metric.labels))
+
+    def scrape(self, **headers):
+        return self.client.get('/metrics', **headers)
+
+    @override_settings(GRAPHQL_TRACE_SAMPLE_RATE=1.0)
+    def test_sampled_operation_records_resolvers(self):
+        Collection.objects.create(title='Phones')
+        before = self.series(metrics.RESOLVER_DURATION, operation='Collections', field='Query.getCollections')
+        before = before[2] if before else 0
+        result = schema.execute_sync('query Collections { getCollections { title } }')
+        self.assertIsNone(result.errors)
+        after = self.series(metrics.RESOLVER_DURATION, operation='Collections', field='Query.getCollections')
+        self.assertEqual(after[2], before + 1)
+        self.assertIsNotNone(self.series(metrics.OPERATION_DURATION, operation='Collections', type='query'))
+
+    @override_settings(GRAPHQL_TRACE_SAMPLE_RATE=0)
+    def test_errors_counted_without_sampling(self):
+        labels = {'operation': 'MissingCart', 'field': 'Query.getCart'}
+        before = self.series(metrics.RESOLVER_ERRORS, **labels) or 0
+        result = schema.execute_sync('query MissingCart { getCart(id: 0) { id } }')
+        self.assertIsNotNone(result.errors)
+        self.assertEqual(self.series(metrics.RESOLVER_ERRORS, **labels), before + 1)
+        self.assertIsNone(self.series(metrics.RESOLVER_DURATION, **labels))
+
+    def test_exposition_format(self):
+        histogram = metrics.Histogram('test_seconds', 'Test', ['name'], buckets=(0.1, 1))
+        histogram.observe(0.05, name='a "b"')
+        histogram.observe(5, name='a "b"')
+        self.assertEqual(histogram.expose(), [
+            '# HELP test_seconds Test',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{name="a \\"b\\"",le="0.1"} 1',
+            'test_seconds_bucket{name="a \\"b\\"",le="1"} 1',
+            'test_seconds_bucket{name="a \\"b\\"",le="+Inf"} 2',
+            'test_seconds_sum{name="a \\"b\\""} 5.05',
+            'test_seconds_count{name="a \\"b\\""} 2',
+        ])
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_endpoint(self):
+        self.assertEqual(self.scrape().status_code, 403)
+        response = self.scrape(HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE graphql_operation_duration_seconds histogram', response.content)
+
+
+@override_settings(DATABASE_ROUTERS=[], SQL_QUERY_BUDGET={'MODE': 'log'})
+class BenchmarkTests(TestCase):
+    """A small-scale run of the benchmark harness; see the benchmark command."""
+
+    @classmethod
+    def setUpTestData(cls):
+        benchmark.seed(
+            {'products': 200, 'collections': 5, 'promotions': 3, 'tags': 20, 'customers': 5, 'carts': 5},
+            batch_size=50,
+        )
+
+    def test_workload_runs_without_errors(self):
+        errors = []
+        results = benchmark.run(
+            benchmark.InProcessClient, benchmark.Workload(), sessions=40, warmup=2,
+            on_error=lambda name, messages: errors.append((name, messages)),
+        )
+        self.assertEqual(errors, [])
+        summary = results.summary()
+        for name in ('AllProducts', 'BrowseProducts', 'Search', 'AddToCart', 'Checkout'):
+            self.assertIn(name, summary['operations'])
+        self.assertEqual(summary['operations']['AllProducts']['max_queries'], 1)
+        self.assertEqual(summary['total'], sum(row['count'] for row in summary['operations'].values()))
+        for name, row in summary['operations'].items():
+            self.assertLessEqual(row['p50'], row['p99'], name)
+            self.assertIsNotNone(row['max_queries'], name)
+
+    def test_compare_flags_regressions(self):
+        row = {'count': 10, 'errors': 0, 'p50': 0.01, 'p95': 0.02, 'p99': 0.03, 'mean_queries': 2, 'max_queries': 2}
+        baseline = {'operations': {'BrowseProducts': row}}
+        self.assertEqual(benchmark.compare({'operations': {'BrowseProducts': row}}, baseline), [])
+        slower = {**row, 'p95': 0.1, 'max_queries': 3}
+        regressions = benchmark.compare({'operations': {'BrowseProducts': slower}}, baseline)
+        self.assertEqual(len(regressions), 2)
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class ImportProductsTests(TestCase):
+    def import_csv(self, text):
+        return importer.import_products(importer.read_csv(io.StringIO(text)), index=False)
+
+    def test_reimport_updates_rows(self):
+        self.import_csv('sku,title,collection_title,price,inventory,discount\nA-1,Phone,Phones,100,5,10\n')
+        self.assertEqual(self.import_csv('sku,title,collection_title,price,inventory\nA-1,Phone 2,Phones,200,7\n'), (1, 0))
+        product = Product.objects.get()
+        self.assertEqual((product.title, product.price, product.inventory), ('Phone 2', 200, 7))
+        # The promotion column was absent, so the discount still applies
+        self.assertEqual(product.promotion.discount, 10)
+        self.assertEqual(product.effective_price, Decimal('180.00'))
+        self.assertTrue(product.on_sale)
+
+    def test_missing_columns_keep_values(self):
+        self.import_csv('sku,title,collection_title,price,inventory,image,brand\nA-1,Phone,Phones,100,5,product_images/a.jpg,Acme\n')
+        Product.objects.update(image_hash='abc')
+        self.import_csv('sku,title,collection_title,price,inventory\nA-1,Phone,Phones,100,5\n')
+        product = Product.objects.get()
+        self.assertEqual((product.image.name, product.image_hash, product.brand), ('product_images/a.jpg', 'abc', 'Acme'))
+
+        self.import_csv('sku,title,collection_title,price,inventory,image\nA-1,Phone,Phones,100,5,product_images/a.jpg\n')
+        self.assertEqual(Product.objects.get().image_hash, 'abc')
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.import_csv('sku,title,collection_title,price,inventory,image\nA-1,Phone,Phones,100,5,product_images/b.jpg\n')
+        product = Product.objects.get()
+        self.assertEqual((product.image.name, product.image_hash), ('product_images/b.jpg', ''))
+        self.assertEqual(len(callbacks), 1)
+
+    def test_reimport_keeps_search_terms_of_missing_columns(self):
+        def import_indexed(text):
+            importer.import_products(importer.read_csv(io.StringIO(text)), index=True)
+
+        import_indexed('sku,title,collection_title,price,inventory,brand,description\nA-1,Phone,Phones,100,5,Acme,waterproof\n')
+        import_indexed('sku,title,collection_title,price,inventory\nA-1,Handset,Phones,100,5\n')
+        product = Product.objects.get()
+        self.assertEqual(search_product_ids('acme'), [product.id])
+        self.assertEqual(search_product_ids('waterproof'), [product.id])
+        self.assertEqual(search_product_ids('handset'), [product.id])
+        self.assertEqual(search_product_ids('phone'), [])
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class QueryCostTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Phones')
+        Product.objects.bulk_create(
+            Product(title=f'Phone {i}', slug=f'phone-{i}', price=10, effective_price=10, inventory=5, collection=collection)
+            for i in range(5)
+        )
+
+    def cost(self, result):
+        return result.extensions['cost']['requested']
+
+    def test_unpaginated_list_returns_every_row(self):
+        result = schema.execute_sync('{ getProducts { title collection { title } promotion { discount } } }')
+        self.assertIsNone(result.errors)
+        self.assertEqual(self.cost(result), 3 * 100)
+        self.assertEqual(len(result.data['getProducts']), 5)
+        result = schema.execute_sync('{ getProducts(limit: 2) { title } }')
+        self.assertEqual(len(result.data['getProducts']), 2)
+        self.assertEqual(self.cost(result), 2)
+
+    def test_page_size_clamped(self):
+        query = '{ getProductsConnection(first: %d) { edges { node { title } } } }'
+        result = schema.execute_sync(query % 100000)
+        self.assertIsNone(result.errors)
+        self.assertEqual(self.cost(result), self.cost(schema.execute_sync(query % 100)))
+        self.assertEqual(len(result.data['getProductsConnection']['edges']), 5)
+
+    @override_settings(GRAPHQL_MAX_QUERY_COST=250)
+    def test_expensive_query_rejected(self):
+        result = schema.execute_sync('{ getProducts { title collection { title } promotion { discount } } }')
+        self.assertIsNone(result.data)
+        self.assertEqual(result.errors[0].extensions['code'], 'QUERY_TOO_EXPENSIVE')
+        result = schema.execute_sync('{ getProducts(limit: 50) { title collection { title } promotion { discount } } }')
+        self.assertIsNone(result.errors)
+        # Unlike connections' first, a limit isn't clamped, so it's costed as asked
+        result = schema.execute_sync('{ getUsers(limit: 1000) { id } }')
+        self.assertEqual(result.errors[0].extensions['code'], 'QUERY_TOO_EXPENSIVE')
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class PersistedQueryTests(TestCase):
+    query = '{ getCollections { title } }'
+
+    def setUp(self):
+        caches['default'].clear()
+        Collection.objects.create(title='Phones')
+        self.hash = hashlib.sha256(self.query.encode()).hexdigest()
+
+    def extensions(self, sha256_hash=None, version=1):
+        return {'persistedQuery': {'version': version, 'sha256Hash': sha256_hash or self.hash}}
+
+    def post(self, **body):
+        return self.client.post('/graphql/', body, content_type='application/json').json()
+
+    def error(self, response):
+        return response['errors'][0]['message']
+
+    def test_miss_then_register_then_hit(self):
+        response = self.post(extensions=self.extensions())
+        self.assertEqual(self.error(response), 'PersistedQueryNotFound')
+        self.assertEqual(response['errors'][0]['extensions']['code'], 'PERSISTED_QUERY_NOT_FOUND')
+
+        response = self.post(query=self.query, extensions=self.extensions())
+        self.assertEqual(response['data'], {'getCollections': [{'title': 'Phones'}]})
+
+        response = self.post(extensions=self.extensions())
+        self.assertEqual(response['data'], {'getCollections': [{'title': 'Phones'}]})
+
+    def test_hash_mismatch(self):
+        response = self.post(query=self.query, extensions=self.extensions('0' * 64))
+        self.assertEqual(self.error(response), 'provided sha does not match query')
+
+    def test_get(self):
+        self.post(query=self.query, extensions=self.extensions())
+        response = self.client.get('/graphql/', {'extensions': json.dumps(self.extensions())}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['data'], {'getCollections': [{'title': 'Phones'}]})
+
+    def test_malformed_extensions(self):
+        self.assertEqual(self.error(self.post(extensions={'persistedQuery': 'x'})), 'persistedQuery must be an object')
+        self.assertEqual(self.error(self.post(extensions=self.extensions(version=2))), 'Unsupported persisted query version')
+        response = self.post(query=['not', 'a', 'string'], extensions=self.extensions())
+        self.assertEqual(self.error(response), 'query must be a string')
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Phones')
+        promotion = Promotion.objects.create(description='', discount=10)
+        cls.phone = Product.objects.create(title='Phone', slug='phone', price=100, inventory=5, collection=collection, promotion=promotion)
+        cls.case = Product.objects.create(title='Case', slug='case', price=20, inventory=1, collection=collection)
+        cls.customer = Customer.objects.create(first_name='A', last_name='B', email='a@example.com', phone='0')
+
+    def cart(self, **quantities):
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, product=getattr(self, name), quantity=quantity) for name, quantity in quantities.items()
+        )
+        return cart
+
+    def test_order_snapshots_prices(self):
+        cart = self.cart(phone=2, case=1)
+        order = checkout(cart.id, self.customer.id)
+        prices = dict(OrderItem.objects.filter(order=order).values_list('product_id', 'unit_price'))
+        self.assertEqual(prices, {self.phone.id: Decimal('90.00'), self.case.id: Decimal('20.00')})
+        Product.objects.filter(pk=self.phone.pk).update(price=500, effective_price=500)
+        self.assertEqual(OrderItem.objects.get(order=order, product=self.phone).unit_price, Decimal('90.00'))
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.inventory, 3)
+        self.assertFalse(Cart.objects.filter(pk=cart.pk).exists())
+
+    def test_insufficient_inventory_rolls_back(self):
+        cart = self.cart(phone=1, case=2)
+        with self.assertRaisesMessage(ValueError, f'Not enough inventory for product {self.case.id}'):
+            checkout(cart.id, self.customer.id)
+        self.assertEqual(Product.objects.get(pk=self.phone.pk).inventory, 5)
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(CartItem.objects.filter(cart=cart).count(), 2)
+
+    def test_empty_or_missing_cart(self):
+        with self.assertRaisesMessage(ValueError, 'Cart is empty'):
+            checkout(Cart.objects.create().id, self.customer.id)
+        with self.assertRaisesMessage(ValueError, 'Cart not found'):
+            checkout(0, self.customer.id)
+
+    def test_cart_checked_out_once(self):
+        cart = self.cart(phone=1)
+        checkout(cart.id, self.customer.id)
+        with self.assertRaisesMessage(ValueError, 'Cart not found'):
+            checkout(cart.id, self.customer.id)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Phones')
+
+        def product(title, description='', **fields):
+            return Product.objects.create(
+                title=title, slug='p', price=10, inventory=5, collection=collection, description=description, **fields
+            )
+
+        cls.phone = product('Galaxy phone', brand='Samsung')
+        cls.mention = product('Charger', description='Works with any phone')
+        cls.phones = product('Phones bundle')
+
+    def test_title_outranks_description(self):
+        ids = search_product_ids('phone')
+        self.assertEqual(ids[0], self.phone.id)
+        self.assertLess(ids.index(self.phones.id), ids.index(self.mention.id))
+
+    def test_exact_outranks_prefix(self):
+        ids = search_product_ids('phone')
+        self.assertLess(ids.index(self.phone.id), ids.index(self.phones.id))
+
+    def test_typo(self):
+        self.assertEqual(search_product_ids('galxy'), [self.phone.id])
+        self.assertEqual(search_product_ids('samsng phine'), [self.phone.id])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(search_product_ids('galaxy charger'), [])
+
+    def test_short_words_match_exactly(self):
+        self.assertEqual(_matching_terms('ph'), {'ph': 1.0})
+        self.assertEqual(search_product_ids('ph'), [])
+
+    def test_expansion_is_capped(self):
+        collection = Collection.objects.get()
+        Product.objects.bulk_create(
+            Product(title=f'phone{i}', slug='p', price=10, inventory=5, collection=collection, description='')
+            for i in range(MAX_EXPANSIONS * 2)
+        )
+        rebuild_index()
+        self.assertEqual(len(_matching_terms('pho')), MAX_EXPANSIONS + 1)
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class CartMutationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Phones')
+        cls.phone = Product.objects.create(title='Phone', slug='phone', price=100, inventory=5, collection=collection)
+        cls.case = Product.objects.create(title='Case', slug='case', price=20, inventory=5, collection=collection)
+
+    def setUp(self):
+        self.cart = Cart.objects.create()
+
+    def quantities(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity'))
+
+    def mutate(self, field, items, cart_id=None):
+        return schema.execute_sync(
+            f'mutation ($cart: Int!, $items: [CartItemInput!]!) {{ {field}(cartId: $cart, items: $items) {{ id totalPrice }} }}',
+            variable_values={
+                'cart': self.cart.id if cart_id is None else cart_id,
+                'items': [{'productId': product.id, 'quantity': quantity} for product, quantity in items],
+            },
+        )
+
+    def add_to_cart(self, product_id, quantity=1, cart_id=None):
+        return schema.execute_sync(
+            'mutation ($cart: Int!, $product: Int!, $quantity: Int!) '
+            '{ addToCart(cartId: $cart, itemData: {productId: $product, quantity: $quantity}) { id } }',
+            variable_values={'cart': self.cart.id if cart_id is None else cart_id, 'product': product_id, 'quantity': quantity},
+        )
+
+    def test_add_items_merges_with_existing_lines(self):
+        self.assertIsNone(self.add_to_cart(self.phone.id).errors)
+        result = self.mutate('addItemsToCart', [(self.phone, 2), (self.case, 1), (self.case, 1)])
+        self.assertIsNone(result.errors)
+        self.assertEqual(self.quantities(), {self.phone.id: 3, self.case.id: 2})
+        self.assertEqual(result.data['addItemsToCart']['totalPrice'], 340)
+
+    def test_set_items_replaces_lines(self):
+        self.mutate('addItemsToCart', [(self.phone, 2), (self.case, 1)])
+        result = self.mutate('setCartItems', [(self.phone, 1), (self.case, 0)])
+        self.assertIsNone(result.errors)
+        self.assertEqual(self.quantities(), {self.phone.id: 1})
+
+    def test_bulk_mutations_validate_everything_first(self):
+        self.mutate('addItemsToCart', [(self.phone, 1)])
+        result = self.mutate('addItemsToCart', [(self.case, 1), (Product(id=0), 1)])
+        self.assertEqual(result.errors[0].message, 'Product not found: 0')
+        result = self.mutate('addItemsToCart', [(self.case, 0)])
+        self.assertEqual(result.errors[0].message, 'Quantity must be positive')
+        result = self.mutate('addItemsToCart', [(self.case, 1)], cart_id=0)
+        self.assertEqual(result.errors[0].message, 'Cart not found')
+        self.assertEqual(self.quantities(), {self.phone.id: 1})
+
+    def test_add_to_cart_adds_to_existing_line(self):
+        self.assertIsNone(self.add_to_cart(self.phone.id, 2).errors)
+        self.assertIsNone(self.add_to_cart(self.phone.id, 3).errors)
+        self.assertEqual(self.quantities(), {self.phone.id: 5})
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 1)
+
+    def test_add_to_cart_rejects_missing_cart_and_product(self):
+        self.assertEqual(self.add_to_cart(self.phone.id, cart_id=0).errors[0].message, 'Cart not found')
+        self.assertEqual(self.add_to_cart(0).errors[0].message, 'Product not found')
+        self.assertEqual(self.quantities(), {})
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class PaginationTests(TestCase):
+    query = '''
+    query ($after: String, $sort: ProductSort!) {
+      getProductsConnection(first: 2, after: $after, sort: $sort) {
+        edges { node { title } } pageInfo { hasNextPage endCursor }
+      }
+    }'''
+
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Phones')
+        for i, price in enumerate([30, 10, 20, 10, 50]):
+            Product.objects.create(title=f'Phone {i}', slug='p', price=price, inventory=5, collection=collection)
+
+    def page(self, sort, after=None):
+        return schema.execute_sync(self.query, variable_values={'sort': sort, 'after': after})
+
+    def walk(self, sort):
+        titles, after = [], None
+        while True:
+            result = self.page(sort, after)
+            self.assertIsNone(result.errors)
+            connection = result.data['getProductsConnection']
+            titles += [edge['node']['title'] for edge in connection['edges']]
+            if not connection['pageInfo']['hasNextPage']:
+                return titles
+            after = connection['pageInfo']['endCursor']
+
+    def test_pages_follow_sort(self):
+        self.assertEqual(self.walk('TITLE'), [f'Phone {i}' for i in range(5)])
+        self.assertEqual(self.walk('PRICE'), ['Phone 1', 'Phone 3', 'Phone 2', 'Phone 0', 'Phone 4'])
+
+    def test_invalid_cursors(self):
+        title_cursor = self.page('TITLE').data['getProductsConnection']['pageInfo']['endCursor']
+
+        def cursor(*values):
+            return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+        for sort, after in [
+            ('PRICE', title_cursor),
+            ('PRICE', cursor('effective_price', 'abc', 1)),
+            ('TITLE', cursor('title', 'Phone 1', 'x')),
+            ('TITLE', cursor('Phone 1', 1)),
+            ('TITLE', 'not a cursor'),
+        ]:
+            with self.subTest(sort=sort, after=after):
+                result = self.page(sort, after)
+                self.assertEqual([error.message for error in result.errors], ['Invalid cursor'])
+
+    def test_page_loads_only_selected_relations(self):
+        ContentType.objects.get_for_model(Product)
+
+        def sql(query):
+            with CaptureQueriesContext(connection) as queries:
+                result = schema.execute_sync(query)
+            self.assertIsNone(result.errors)
+            return [q['sql'] for q in queries.captured_queries]
+
+        plain = sql('{ getProductsConnection(first: 2) { edges { node { title } } } }')
+        self.assertEqual(len(plain), 1)
+        self.assertNotIn('JOIN', plain[0])
+
+        nested = sql('''
+        { getProductsConnection(first: 2) { edges { node { title collection { title } tags { label } } } } }''')
+        self.assertEqual(len(nested), 2)
+        self.assertIn('JOIN', nested[0])
+        self.assertIn('tags_taggeditem', nested[1])
+
+        filtered = sql('{ filterProducts(first: 2) { products { edges { node { title tags { label } } } } } }')
+        self.assertTrue(any('tags_taggeditem' in query for query in filtered))
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class FacetTests(TestCase):
+    query = '''
+    query ($bands: [String!]) {
+      filterProducts(filters: {priceBands: $bands}) { products { edges { node { title } } } }
+    }'''
+
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Phones')
+        for title, price in [('Cheap', 10), ('Mid', 30), ('Dear', 300)]:
+            Product.objects.create(title=title, slug='p', price=price, inventory=5, collection=collection)
+
+    def titles(self, bands):
+        result = schema.execute_sync(self.query, variable_values={'bands': bands})
+        self.assertIsNone(result.errors)
+        return [edge['node']['title'] for edge in result.data['filterProducts']['products']['edges']]
+
+    def test_price_bands_filter(self):
+        self.assertEqual(self.titles(['0-25', '250+']), ['Cheap', 'Dear'])
+
+    def test_unknown_price_band_is_rejected(self):
+        result = schema.execute_sync(self.query, variable_values={'bands': ['0-25', 'cheap']})
+        self.assertEqual([error.message for error in result.errors], ['Unknown price band: cheap'])
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class CatalogCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Phones')
+        cls.product = Product.objects.create(title='Phone', slug='p', price=10, inventory=5, collection=collection)
+
+    def setUp(self):
+        caches['catalog'].clear()
+
+    def execute(self, query, queries):
+        with self.assertNumQueries(queries):
+            result = schema.execute_sync(query)
+        self.assertIsNone(result.errors)
+        return result.data
+
+    def assert_save_invalidates(self, query, title):
+        self.assertEqual(title(self.execute(query, 1)), 'Phone')
+        self.assertEqual(title(self.execute(query, 0)), 'Phone')
+        self.product.title = 'Renamed'
+        self.product.save()
+        self.assertEqual(title(self.execute(query, 1)), 'Renamed')
+
+    def test_product_save_invalidates_get_product(self):
+        self.assert_save_invalidates(
+            f'{{ getProduct(id: {self.product.id}) {{ title }} }}', lambda data: data['getProduct']['title'],
+        )
+
+    def test_product_save_invalidates_get_products(self):
+        self.assert_save_invalidates('{ getProducts { title } }', lambda data: data['getProducts'][0]['title'])
+
+    def test_tag_rename_invalidates_products(self):
+        tag = Tag.objects.create(label='summer')
+        TaggedItem.objects.create(tag=tag, content_type=ContentType.objects.get_for_model(Product), object_id=self.product.id)
+        query = '{ getProducts { tags { label } } }'
+        self.assertEqual(schema.execute_sync(query).data['getProducts'][0]['tags'], [{'label': 'summer'}])
+        tag.label = 'winter'
+        tag.save()
+        self.assertEqual(schema.execute_sync(query).data['getProducts'][0]['tags'], [{'label': 'winter'}])
+
+    @override_settings(REPLICA_PIN_SECONDS=5)
+    def test_invalidation_marked_for_pin_window(self):
+        self.assertFalse(cache.recently_invalidated(['product']))
+        self.product.save()
+        self.assertTrue(cache.recently_invalidated(['catalog', 'product']))
+        self.assertFalse(cache.recently_invalidated(['collection']))
+
+    def test_evicted_version_does_not_serve_stale_entries(self):
+        query = '{ getProducts { title } }'
+        self.execute(query, 1)
+        # The version key is evicted while the cached response survives
+        caches['catalog'].delete('version:product')
+        Product.objects.filter(pk=self.product.pk).update(title='Renamed')
+        self.assertEqual(self.execute(query, 1)['getProducts'][0]['title'], 'Renamed')
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Phones')
+        cls.phone = Product.objects.create(title='Phone', slug='p', price=10, inventory=5, collection=collection)
+        Product.objects.create(title='Tablet', slug='t', price=20, inventory=5, collection=collection)
+
+    async def test_async_resolvers(self):
+        view = AsyncPersistedQueryGraphQLView.as_view(schema=schema)
+        query = f'''{{
+          getProduct(id: {self.phone.id}) {{ title }}
+          getProductsConnection(first: 1) {{ edges {{ node {{ title }} }} pageInfo {{ hasNextPage }} totalCount }}
+        }}'''
+        request = AsyncRequestFactory().post('/graphql/', {'query': query}, content_type='application/json')
+        response = await view(request)
+        self.assertEqual(json.loads(response.content)['data'], {
+            'getProduct': {'title': 'Phone'},
+            'getProductsConnection': {
+                'edges': [{'node': {'title': 'Phone'}}], 'pageInfo': {'hasNextPage': True}, 'totalCount': 2,
+            },
+        })
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class PromotionPriceTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Phones')
+        self.promotion = Promotion.objects.create(description='Sale', discount=10)
+        self.product = Product.objects.create(
+            title='Phone', slug='p', price=Decimal('19.99'), inventory=5, collection=collection, promotion=self.promotion,
+        )
+
+    def test_price_follows_promotion_changes(self):
+        self.assertEqual(self.product.effective_price, Decimal('17.99'))
+        self.promotion.discount = 25
+        self.promotion.save()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.effective_price, self.product.on_sale), (Decimal('14.99'), True))
+
+        promotions.expire_promotion(self.promotion)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.effective_price, self.product.on_sale), (Decimal('19.99'), False))
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class PromotionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Collection.objects.create(title='Phones')
+        cls.cases = Collection.objects.create(title='Cases')
+        cls.phone = Product.objects.create(title='Phone', slug='p', price=100, inventory=5, collection=cls.phones)
+        cls.acme_case = Product.objects.create(
+            title='Case', slug='c', price=100, inventory=5, collection=cls.cases, brand='Acme',
+        )
+        cls.tagged_case = Product.objects.create(title='Sleeve', slug='s', price=100, inventory=5, collection=cls.cases)
+        cls.tag = Tag.objects.create(label='summer')
+        TaggedItem.objects.create(
+            tag=cls.tag, content_type=ContentType.objects.get_for_model(Product), object_id=cls.tagged_case.id,
+        )
+
+    def promotion(self, discount, **target):
+        promotion = Promotion.objects.create(description=f'{discount}% off', discount=discount, status=Promotion.STATUS_SCHEDULED)
+        if target:
+            PromotionTarget.objects.create(promotion=promotion, **target)
+        return promotion
+
+    def prices(self):
+        return dict(Product.objects.values_list('title', 'effective_price'))
+
+    def test_target_products(self):
+        def targeted(**target):
+            return set(promotions.target_products(self.promotion(10, **target)))
+
+        self.assertEqual(targeted(collection=self.phones), {self.phone})
+        self.assertEqual(targeted(brand='Acme'), {self.acme_case})
+        self.assertEqual(targeted(tag=self.tag), {self.tagged_case})
+        self.assertEqual(targeted(), set())
+
+    def test_apply_promotion(self):
+        promotion = self.promotion(20, collection=self.cases)
+        self.assertEqual(promotions.apply_promotion(promotion, batch_size=1), 2)
+        self.assertEqual(Promotion.objects.get(pk=promotion.pk).status, Promotion.STATUS_ACTIVE)
+        self.assertEqual(self.prices(), {'Phone': 100, 'Case': 80, 'Sleeve': 80})
+
+    def test_overlapping_promotions(self):
+        collection_sale = self.promotion(20, collection=self.cases)
+        sitewide = self.promotion(10, collection=self.phones)
+        PromotionTarget.objects.create(promotion=sitewide, collection=self.cases)
+        promotions.apply_promotion(collection_sale)
+        # The smaller sitewide discount doesn't replace the collection sale
+        promotions.apply_promotion(sitewide)
+        self.assertEqual(self.prices(), {'Phone': 90, 'Case': 80, 'Sleeve': 80})
+
+        bigger = self.promotion(50, brand='Acme')
+        promotions.apply_promotion(bigger)
+        self.assertEqual(self.prices(), {'Phone': 90, 'Case': 50, 'Sleeve': 80})
+        # Expiring one hands its products the best promotion still running
+        promotions.expire_promotion(bigger)
+        self.assertEqual(self.prices(), {'Phone': 90, 'Case': 80, 'Sleeve': 80})
+        promotions.expire_promotion(collection_sale)
+        self.assertEqual(self.prices(), {'Phone': 90, 'Case': 90, 'Sleeve': 90})
+
+    def test_future_start_is_scheduled(self):
+        now = timezone.now()
+        promotion = Promotion.objects.create(description='Later', discount=10, starts_at=now + timedelta(hours=1))
+        self.assertEqual(promotion.status, Promotion.STATUS_SCHEDULED)
+        self.assertEqual(Promotion.objects.create(description='Now', discount=10).status, Promotion.STATUS_ACTIVE)
+
+    def test_sweep_promotions(self):
+        now = timezone.now()
+        promotion = Promotion.objects.create(
+            description='Weekend', discount=10, starts_at=now + timedelta(hours=1), ends_at=now + timedelta(days=2),
+        )
+        PromotionTarget.objects.create(promotion=promotion, collection=self.phones)
+        self.assertEqual(promotions.sweep_promotions(now), (0, 0))
+        self.assertEqual(self.prices()['Phone'], 100)
+
+        self.assertEqual(promotions.sweep_promotions(now + timedelta(hours=2)), (1, 0))
+        self.assertEqual(self.prices()['Phone'], 90)
+
+        self.assertEqual(promotions.sweep_promotions(now + timedelta(days=3)), (0, 1))
+        self.assertEqual(Promotion.objects.get(pk=promotion.pk).status, Promotion.STATUS_EXPIRED)
+        self.assertEqual(self.prices()['Phone'], 100)
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0)
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        storage = override_settings(MEDIA_ROOT=media)
+        storage.enable()
+        self.addCleanup(storage.disable)
+        self.collection = Collection.objects.create(title='Phones')
+
+    def upload(self, size=(400, 200)):
+        buffer = io.BytesIO()
+        Image.new('RGBA', size, (255, 0, 0, 128)).save(buffer, format='PNG')
+        return SimpleUploadedFile('phone.png', buffer.getvalue(), content_type='image/png')
+
+    def test_variants_generated_on_save(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                title='Phone', slug='p', price=10, inventory=5, collection=self.collection,
+                image=images.save_upload(self.upload()),
+            )
+        product.refresh_from_db()
+        self.assertEqual(len(product.image_hash), 64)
+        for width in images.VARIANT_WIDTHS:
+            for format in images.VARIANT_FORMATS:
+                with default_storage.open(images.variant_name(product.image_hash, width, format)) as file:
+                    # Never upscaled past the 400px original
+                    self.assertEqual(Image.open(file).width, min(width, 400))
+
+    def test_new_image_clears_old_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                title='Phone', slug='p', price=10, inventory=5, collection=self.collection,
+                image=images.save_upload(self.upload()),
+            )
+        product = Product.objects.get(pk=product.pk)
+        old_hash = product.image_hash
+        product.image = images.save_upload(self.upload(size=(300, 100)))
+        with self.captureOnCommitCallbacks() as callbacks:
+            product.save()
+        self.assertEqual(Product.objects.get(pk=product.pk).image_hash, '')
+        for callback in callbacks:
+            callback()
+        self.assertNotIn(Product.objects.get(pk=product.pk).image_hash, ('', old_hash))
+
+        product = Product.objects.get(pk=product.pk)
+        product.title = 'Renamed'
+        product.save()
+        self.assertNotEqual(Product.objects.get(pk=product.pk).image_hash, '')
+
+    def test_identical_upload_reuses_file(self):
+        self.assertEqual(images.save_upload(self.upload()), images.save_upload(self.upload()))
+
+    @override_settings(PRODUCT_IMAGE_MAX_UPLOAD_SIZE=1024)
+    def test_oversized_upload_stops_at_limit(self):
+        handler = images.LimitedUploadHandler(RequestFactory().post('/graphql/'))
+        handler.new_file('image', 'big.png', 'image/png', 4096)
+        handler.receive_data_chunk(b'x' * 1000, 0)
+        with self.assertRaises(StopUpload):
+            handler.receive_data_chunk(b'x' * 1000, 1000)
+        self.assertEqual(handler.file.tell(), 1000)
+        self.assertTrue(handler.request.upload_too_large)
+
+    @override_settings(PRODUCT_IMAGE_MAX_UPLOAD_SIZE=1024)
+    def test_oversized_graphql_upload_rejected(self):
+        product = Product.objects.create(title='Phone', slug='p', price=10, inventory=5, collection=self.collection)
+        query = 'mutation ($image: Upload) { updateProduct(id: %d, image: $image) { id } }' % product.id
+        response = self.client.post('/graphql/', {
+            'operations': json.dumps({'query': query, 'variables': {'image': None}}),
+            'map': json.dumps({'0': ['variables.image']}),
+            '0': SimpleUploadedFile('big.png', b'x' * 4096, content_type='image/png'),
+        })
+        self.assertEqual(response.status_code, 413)
+        self.assertIn(b'Image is larger than', response.content)
+
+
+class FakeConnection:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('storefront.db.pool.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connected = []
+        self.pings = []
+        self.ping_ok = True
+
+    def pool(self, size=2, timeout=5, max_age=600, ping_after=30):
+        return ConnectionPool('default', size=size, timeout=timeout, max_age=max_age, ping_after=ping_after)
+
+    def connect(self):
+        connection = FakeConnection()
+        self.connected.append(connection)
+        return connection
+
+    def ping(self, connection):
+        self.pings.append(connection)
+        return self.ping_ok
+
+    def checkout(self, pool):
+        return pool.checkout(self.connect, self.ping)
+
+    def test_checkin_reuses_connection(self):
+        pool = self.pool()
+        first = self.checkout(pool)
+        second = self.checkout(pool)
+        self.assertEqual(pool.stats()['in_use'], 2)
+        pool.checkin(first)
+        self.assertIs(self.checkout(pool), first)
+        pool.checkin(first)
+        pool.checkin(second)
+        stats = pool.stats()
+        self.assertEqual(
+            {key: stats[key] for key in ('open', 'idle', 'in_use', 'checkouts', 'created', 'discarded')},
+            {'open': 2, 'idle': 2, 'in_use': 0, 'checkouts': 3, 'created': 2, 'discarded': 0},
+        )
+        self.assertEqual(self.pings, [])
+
+    def test_unreusable_checkin_closes_connection(self):
+        pool = self.pool()
+        connection = self.checkout(pool)
+        pool.checkin(connection, reusable=False)
+        self.assertTrue(connection.closed)
+        stats = pool.stats()
+        self.assertEqual((stats['open'], stats['idle'], stats['in_use'], stats['discarded']), (0, 0, 0, 1))
+
+    def test_old_connection_discarded(self):
+        pool = self.pool(max_age=600)
+        old = self.checkout(pool)
+        pool.checkin(old)
+        self.clock.now += 601
+        new = self.checkout(pool)
+        self.assertIsNot(new, old)
+        self.assertTrue(old.closed)
+        stats = pool.stats()
+        self.assertEqual((stats['open'], stats['created'], stats['discarded']), (1, 2, 1))
+
+        # Past MAX_AGE at checkin too
+        self.clock.now += 601
+        pool.checkin(new)
+        self.assertTrue(new.closed)
+        self.assertEqual(pool.stats()['open'], 0)
+
+    def test_idle_connection_pinged(self):
+        pool = self.pool(ping_after=30)
+        connection = self.checkout(pool)
+        pool.checkin(connection)
+        self.clock.now += 31
+        self.assertIs(self.checkout(pool), connection)
+        self.assertEqual(self.pings, [connection])
+
+        pool.checkin(connection)
+        self.clock.now += 31
+        self.ping_ok = False
+        self.assertIsNot(self.checkout(pool), connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['discarded'], 1)
+
+    def test_checkout_times_out_when_full(self):
+        pool = self.pool(size=1, timeout=0)
+        self.checkout(pool)
+        with self.assertRaises(PoolTimeout):
+            self.checkout(pool)
+        stats = pool.stats()
+        self.assertEqual((stats['open'], stats['in_use'], stats['timeouts'], stats['checkouts']), (1, 1, 1, 1))
+
+    def test_checkout_waits_for_checkin(self):
+        pool = self.pool(size=1)
+        connection = self.checkout(pool)
+        checked_out = []
+        waiting = threading.Thread(target=lambda: checked_out.append(self.checkout(pool)))
+        waiting.start()
+        # The waiter blocks on the condition until the checkin notifies it
+        while not pool._lock._waiters:
+            threading.Event().wait(0.001)
+        pool.checkin(connection)
+        waiting.join(5)
+        self.assertEqual(checked_out, [connection])
+        self.assertEqual(pool.stats()['waits'], 1)
+
+    def test_failed_connect_frees_slot(self):
+        pool = self.pool(size=1)
+
+        def connect():
+            raise OSError('refused')
+
+        with self.assertRaises(OSError):
+            pool.checkout(connect, self.ping)
+        stats = pool.stats()
+        self.assertEqual((stats['open'], stats['in_use'], stats['created']), (0, 0, 0))
+        self.checkout(pool)
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        phones = Collection.objects.create(title='Phones')
+        promotion = Promotion.objects.create(description='Sale', discount=10)
+        cls.products = [
+            Product.objects.create(
+                sku=f'P-{i}', title=f'Phone {i}', slug=f'phone-{i}', price=100, inventory=5, collection=phones,
+                promotion=promotion if i == 0 else None,
+            )
+            for i in range(5)
+        ]
+        content_type = ContentType.objects.get_for_model(Product)
+        for label in ['sale', 'new']:
+            TaggedItem.objects.create(
+                tag=Tag.objects.create(label=label), content_type=content_type, object_id=cls.products[0].id,
+            )
+        customer = Customer.objects.create(first_name='Ada', last_name='L', email='ada@example.com', phone='0')
+        cls.order = Order.objects.create(customer=customer)
+        for product in cls.products[:3]:
+            OrderItem.objects.create(order=cls.order, product=product, quantity=2, unit_price=product.effective_price)
+
+    def setUp(self):
+        ContentType.objects.get_for_model(Product)
+
+    def test_product_rows_query_per_chunk(self):
+        # Every chunk is one product query plus one tag query, and one more
+        # query finds the end
+        with self.assertNumQueries(3 * 2 + 1):
+            rows = list(export.product_rows(Product.objects.all(), chunk_size=2))
+        with self.assertNumQueries(1 * 2 + 1):
+            self.assertEqual(list(export.product_rows(Product.objects.all(), chunk_size=5)), rows)
+        self.assertEqual([row['sku'] for row in rows], [f'P-{i}' for i in range(5)])
+        self.assertEqual(rows[0]['tags'], ['new', 'sale'])
+        self.assertEqual((rows[0]['collection_title'], rows[0]['discount'], rows[0]['effective_price']), ('Phones', 10, 90))
+        self.assertEqual((rows[1]['tags'], rows[1]['discount']), ([], None))
+
+    def test_order_rows_query_per_chunk(self):
+        with self.assertNumQueries(2 + 1):
+            rows = list(export.order_rows(Order.objects.all(), chunk_size=2))
+        self.assertEqual([row['sku'] for row in rows], ['P-0', 'P-1', 'P-2'])
+        self.assertEqual(rows[0], {
+            'order_id': self.order.id,
+            'placed_at': self.order.placed_at,
+            'payment_status': 'Pending',
+            'customer_id': self.order.customer_id,
+            'customer_name': 'Ada L',
+            'customer_email': 'ada@example.com',
+            'product_id': self.products[0].id,
+            'sku': 'P-0',
+            'product_title': 'Phone 0',
+            'quantity': 2,
+            'unit_price': Decimal('90.00'),
+        })
+
+    def export_command(self, *args):
+        with tempfile.NamedTemporaryFile('r', suffix='.out', encoding='utf-8') as file:
+            call_command('export_catalog', *args, '--output', file.name, '--chunk-size', '2')
+            return file.read()
+
+    def test_command_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export_command('products'))))
+        self.assertEqual(list(rows[0]), export.PRODUCT_COLUMNS)
+        self.assertEqual(len(rows), 5)
+        # Lists are flattened with |
+        self.assertEqual((rows[0]['sku'], rows[0]['tags'], rows[0]['discount']), ('P-0', 'new|sale', '10'))
+        self.assertEqual((rows[1]['tags'], rows[1]['discount']), ('', ''))
+
+        rows = list(csv.DictReader(io.StringIO(self.export_command('orders'))))
+        self.assertEqual([(row['order_id'], row['sku'], row['unit_price']) for row in rows], [
+            (str(self.order.id), 'P-0', '90.00'), (str(self.order.id), 'P-1', '100.00'), (str(self.order.id), 'P-2', '100.00'),
+        ])
+
+    def test_command_jsonl(self):
+        rows = [json.loads(line) for line in self.export_command('products', '--format', 'jsonl').splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual((rows[0]['tags'], rows[0]['price'], rows[0]['on_sale']), (['new', 'sale'], '100.00', True))
+
+        rows = [json.loads(line) for line in self.export_command('orders', '--format', 'jsonl').splitlines()]
+        self.assertEqual([row['quantity'] for row in rows], [2, 2, 2])
+
+    def test_admin_actions(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        response = self.client.post('/admin/store/product/', {
+            'action': 'export_csv', '_selected_action': [self.products[0].id, self.products[1].id],
+        })
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="products.csv"')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row['sku'] for row in rows], ['P-0', 'P-1'])
+
+        response = self.client.post('/admin/store/order/', {'action': 'export_jsonl', '_selected_action': [self.order.id]})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['sku'] for line in lines], ['P-0', 'P-1', 'P-2'])
@@ -1,9 +1,13 @@
 import strawberry
 from typing import List, Optional
 import strawberry.django
-from . import models
+from . import images, models
 from datetime import datetime
+from enum import Enum
 from django.contrib.auth.models import User
+from tags.models import Tag
+from django.db.models import QuerySet
+from strawberry.utils.inspect import in_async_context
 
 @strawberry.django.type(User)
 class UserType:
@@ -20,6 +24,17 @@ class CollectionType:
 class PromotionType:
     discount: Optional[int]
 
+@strawberry.django.type(Tag)
+class TagType:
+    label: str
+
+@strawberry.type
+class ImageVariant:
+    width: int
+    format: str
+    url: str
+
+
 @strawberry.django.type(models.Product)
 class ProductType:
     id: int
@@ -38,40 +53,82 @@ class ProductType:
     promotion: Optional[PromotionType]
 
     
-    @strawberry.field
-    def price_after_discount(self) -> float:
-        if self.promotion:
-            discount_amount = (self.price * self.promotion.discount) / 100
-            return round(self.price - discount_amount, 2)
-        return self.price 
+    price_after_discount: float = strawberry.django.field(field_name='effective_price')
+    on_sale: bool
+
+    # Tags of every product in a list come from one prefetch query
+    @strawberry.django.field(prefetch_related=[models.tagged_items_prefetch()])
+    def tags(self) -> List[TagType]:
+        return [item.tag for item in self.tagged_items.all()]
+
+    @strawberry.django.field(only=['image_hash'])
+    def image_variants(self, width: Optional[int] = None) -> List[ImageVariant]:
+        # Empty until the variant worker has processed the current image
+        if not self.image_hash:
+            return []
+        width = images.pick_width(width)
+        return [
+            ImageVariant(width=width, format=format, url=images.variant_url(self.image_hash, width, format))
+            for format in images.VARIANT_FORMATS
+        ]
     
+
+@strawberry.enum
+class ProductSort(Enum):
+    TITLE = 'title'
+    PRICE = 'effective_price'
+
+
+@strawberry.type
+class PageInfo:
+    has_next_page: bool
+    end_cursor: Optional[str]
+
+
+@strawberry.type
+class ProductEdge:
+    cursor: str
+    node: ProductType
+
+
+@strawberry.type
+class ProductConnection:
+    edges: List[ProductEdge]
+    page_info: PageInfo
+    queryset: strawberry.Private[QuerySet]
+
     @strawberry.field
-    def on_sale(self) -> bool:
-        return bool(self.promotion and self.promotion.discount > 0 )
+    def total_count(self) -> int:
+        # Only runs the COUNT when the client selects totalCount
+        if in_async_context():
+            return self.queryset.acount()
+        return self.queryset.count()
     
 
 @strawberry.django.type(models.CartItem)
 class CartItemType:
     product: ProductType
-    product_id: int
+    product_id: int = strawberry.django.field(only=['product_id'])
     quantity: int
 
-    @strawberry.field
+    @strawberry.django.field(only=['product__title'], select_related=['product'])
     def product_name(self) -> str:
         return self.product.title
     
-    @strawberry.field
+    @strawberry.django.field(only=['product__effective_price'], select_related=['product'])
     def product_price(self) -> float:
-        if self.product.promotion:
-            discount_amount = (self.product.price * self.product.promotion.discount) / 100
-            return round(self.product.price - discount_amount, 2)
-        else:
-            return self.product.price
+        return self.product.effective_price
     
-    @strawberry.field
+    @strawberry.django.field(only=['product__promotion__discount'], select_related=['product__promotion'])
     def discount(self) -> float:
         return self.product.promotion.discount if self.product.promotion else 0
 
+    @strawberry.django.field(annotate={'subtotal': models.CartItemQuerySet.SUBTOTAL})
+    def subtotal(self) -> float:
+        if not hasattr(self, 'subtotal'):
+            return float(models.CartItem.objects.with_subtotals().get(pk=self.pk).subtotal)
+        return float(self.subtotal)
+
 @strawberry.django.type(models.Cart)
 class CartType:
     id: int
@@ -79,14 +136,27 @@ class CartType:
 
     @strawberry.field
     def total_price(self) -> float:
-        total = 0
-        for item in self.items.all():
-            if item.product.promotion:
-                discount_amount = (item.product.price * item.product.promotion.discount) / 100
-                total +=  (round(item.product.price - discount_amount, 2) * item.quantity)
-            else:
-                total += (item.product.price * item.quantity)
-        return total
+        items = models.CartItem.objects.filter(cart=self)
+        if in_async_context():
+            return items.atotal_price()
+        return float(items.total_price())
+
+
+@strawberry.django.type(models.OrderItem)
+class OrderItemType:
+    product: ProductType
+    product_id: int = strawberry.django.field(only=['product_id'])
+    quantity: int
+    unit_price: float
+
+
+@strawberry.django.type(models.Order)
+class OrderType:
+    id: int
+    placed_at: datetime
+    payment_status: str
+    customer_id: int = strawberry.django.field(only=['customer_id'])
+    items: List[OrderItemType] = strawberry.django.field(field_name='orderitem_set')
 
 
 @strawberry.django.input(models.CartItem)
@@ -95,3 +165,58 @@ class CartItemInput:
     quantity: int
 
 
+@strawberry.input
+class ProductSearchFilter:
+    brand: Optional[str] = None
+    model: Optional[str] = None
+    color: Optional[str] = None
+    collection_title: Optional[str] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+
+    def to_lookups(self) -> dict:
+        lookups = {
+            'brand': self.brand,
+            'model': self.model,
+            'color': self.color,
+            'collection__title': self.collection_title,
+            'effective_price__gte': self.min_price,
+            'effective_price__lte': self.max_price,
+        }
+        return {key: value for key, value in lookups.items() if value is not None}
+
+
+@strawberry.input
+class ProductFacetFilter:
+    brands: Optional[List[str]] = None
+    models: Optional[List[str]] = None
+    colors: Optional[List[str]] = None
+    collections: Optional[List[str]] = None
+    price_bands: Optional[List[str]] = None
+
+    def to_selection(self) -> dict:
+        return {
+            'brand': self.brands,
+            'model': self.models,
+            'color': self.colors,
+            'collection': self.collections,
+            'price': self.price_bands,
+        }
+
+
+@strawberry.type
+class FacetValue:
+    value: str
+    count: int
+
+
+@strawberry.type
+class Facet:
+    name: str
+    values: List[FacetValue]
+
+
+@strawberry.type
+class FilteredProducts:
+    products: ProductConnection
+    facets: List[Facet]
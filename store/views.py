@@ -1,7 +1,126 @@
-from django.http import JsonResponse
-from strawberry.django.views import GraphQLView
+import hashlib
+import hmac
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseForbidden
+from graphql import GraphQLError
+from strawberry.django.views import AsyncGraphQLView, GraphQLView
+from strawberry.http.exceptions import HTTPException
+from strawberry.types import ExecutionResult
+from . import metrics
+from .images import upload_too_large_message
 from .schema import schema
 
 
+class PersistedQueryNotFound(Exception):
+    pass
 
-graphql_view = GraphQLView.as_view(schema=schema)
\ No newline at end of file
+
+class PersistedQueryMixin:
+    """
+    Automatic persisted queries (Apollo APQ protocol) for the GraphQL views.
+    Clients send `extensions.persistedQuery.sha256Hash` instead of the query
+    text; unknown hashes answer PersistedQueryNotFound so the client retries
+    once with the full query, which is then stored under its hash.
+    """
+
+    def get_persisted_queries(self):
+        return caches[getattr(settings, 'PERSISTED_QUERY_CACHE', 'default')]
+
+    def resolve_persisted_query(self, data):
+        extensions = data.get('extensions') or {}
+        persisted = extensions.get('persistedQuery') if isinstance(extensions, dict) else None
+        if not persisted:
+            return data
+        if not isinstance(persisted, dict):
+            raise GraphQLError('persistedQuery must be an object')
+
+        sha256_hash = persisted.get('sha256Hash')
+        if persisted.get('version') != 1 or not isinstance(sha256_hash, str) or not sha256_hash:
+            raise GraphQLError('Unsupported persisted query version')
+
+        key = f'apq:{sha256_hash}'
+        query = data.get('query')
+        if query is not None and not isinstance(query, str):
+            raise GraphQLError('query must be a string')
+        if query:
+            if hashlib.sha256(query.encode()).hexdigest() != sha256_hash:
+                raise GraphQLError('provided sha does not match query')
+            self.get_persisted_queries().set(key, query, timeout=None)
+            return data
+
+        query = self.get_persisted_queries().get(key)
+        if query is None:
+            raise PersistedQueryNotFound()
+        return {**data, 'query': query}
+
+    def parse_json(self, data):
+        data = super().parse_json(data)
+        if isinstance(data, dict) and 'extensions' in data:
+            data = self.resolve_persisted_query(data)
+        return data
+
+    def parse_query_params(self, params):
+        params = super().parse_query_params(params)
+        if isinstance(params.get('extensions'), str):
+            params['extensions'] = super().parse_json(params['extensions'])
+            params = self.resolve_persisted_query(params)
+        return params
+
+    def persisted_query_error(self, error):
+        if isinstance(error, PersistedQueryNotFound):
+            error = GraphQLError(
+                'PersistedQueryNotFound',
+                extensions={'code': 'PERSISTED_QUERY_NOT_FOUND'},
+            )
+        return ExecutionResult(data=None, errors=[error])
+
+    def check_upload_size(self, request):
+        # Reading FILES runs the upload handlers, which stop at the size limit
+        request = request.request
+        request.FILES
+        if getattr(request, 'upload_too_large', False):
+            raise HTTPException(413, upload_too_large_message())
+
+
+class PersistedQueryGraphQLView(PersistedQueryMixin, GraphQLView):
+    def parse_multipart(self, request):
+        self.check_upload_size(request)
+        return super().parse_multipart(request)
+
+    def execute_operation(self, request, context, root_value):
+        try:
+            return super().execute_operation(request, context, root_value)
+        except (PersistedQueryNotFound, GraphQLError) as e:
+            return self.persisted_query_error(e)
+
+
+class AsyncPersistedQueryGraphQLView(PersistedQueryMixin, AsyncGraphQLView):
+    """
+    Served under ASGI: async resolvers use the async ORM and independent
+    top-level fields resolve concurrently on the event loop.
+    """
+
+    async def parse_multipart(self, request):
+        self.check_upload_size(request)
+        return await super().parse_multipart(request)
+
+    async def execute_operation(self, request, context, root_value):
+        try:
+            return await super().execute_operation(request, context, root_value)
+        except (PersistedQueryNotFound, GraphQLError) as e:
+            return self.persisted_query_error(e)
+
+
+if settings.GRAPHQL_ASYNC:
+    graphql_view = AsyncPersistedQueryGraphQLView.as_view(schema=schema, multipart_uploads_enabled=True)
+else:
+    graphql_view = PersistedQueryGraphQLView.as_view(schema=schema, multipart_uploads_enabled=True)
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; set METRICS_TOKEN to require a bearer token."""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'storefront.settings')
+# Mount the async GraphQL view when running under an ASGI server
+os.environ.setdefault('GRAPHQL_ASYNC', '1')
 
 application = get_asgi_application()
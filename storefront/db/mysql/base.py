@@ -0,0 +1,11 @@
+from django.db.backends.mysql import base
+from storefront.db.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    def ping(self, connection):
+        try:
+            connection.ping()
+        except self.Database.Error:
+            return False
+        return True
@@ -0,0 +1,249 @@
+"""
+Per-worker database connection pool.
+
+Django keeps one connection per thread and, with CONN_MAX_AGE = 0, opens
+and closes it around every request. The pooled backends (see
+storefront.db.mysql) instead return the raw connection to a pool owned by
+the worker process when Django closes it, and hand it to the next request
+in any thread. The pool caps how many connections a worker holds open,
+pings connections that sat idle, retires them after MAX_AGE, and keeps
+counters for wait time and checkouts.
+
+Configure per database with a POOL entry:
+
+    'CONN_MAX_AGE': 0,
+    'POOL': {'SIZE': 10, 'TIMEOUT': 5, 'MAX_AGE': 600, 'PING_AFTER': 30},
+
+It is plain threading, so it serves WSGI threads and the ASGI handler's
+sync_to_async threads alike.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Most connections one worker process keeps open to this database
+    'SIZE': 10,
+    # Seconds a request waits for a free connection before failing
+    'TIMEOUT': 5,
+    # Seconds after which a connection is closed instead of reused
+    'MAX_AGE': 600,
+    # Idle seconds after which a connection is pinged before reuse
+    'PING_AFTER': 30,
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, alias, size, timeout, max_age, ping_after):
+        self.alias = alias
+        self.size = size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.ping_after = ping_after
+        self.pid = os.getpid()
+        self._lock = threading.Condition()
+        # (connection, created_at, last_used); reused LIFO so hot ones stay warm
+        self._idle = deque()
+        self._created_at = {}
+        self._open = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+        self.created = 0
+        self.discarded = 0
+
+    def checkout(self, connect, ping):
+        """
+        Return an idle connection (pinged if it sat for PING_AFTER seconds)
+        or one from `connect()`, waiting up to TIMEOUT while the pool is full.
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        with self._lock:
+            while not self._idle and self._open >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(
+                        f'No connection to {self.alias!r} free within {self.timeout}s '
+                        f'({self.size} in use by this worker)'
+                    )
+                waited = True
+                self._lock.wait(remaining)
+            entry = self._idle.pop() if self._idle else None
+            if entry is None:
+                self._open += 1
+            self.in_use += 1
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+                self.wait_seconds += time.monotonic() - started
+
+        try:
+            connection = self._revive(entry, ping) if entry else None
+            if connection is None:
+                connection = connect()
+                self._created_at[id(connection)] = time.monotonic()
+                with self._lock:
+                    self.created += 1
+        except BaseException:
+            with self._lock:
+                self._open -= 1
+                self.in_use -= 1
+                self._lock.notify()
+            raise
+        return connection
+
+    def _revive(self, entry, ping):
+        connection, created_at, last_used = entry
+        now = time.monotonic()
+        if now - created_at < self.max_age and (now - last_used < self.ping_after or ping(connection)):
+            self._created_at[id(connection)] = created_at
+            return connection
+        with self._lock:
+            self.discarded += 1
+        _close_quietly(connection)
+        return None
+
+    def checkin(self, connection, reusable=True):
+        created_at = self._created_at.pop(id(connection), 0)
+        now = time.monotonic()
+        reusable = reusable and now - created_at < self.max_age
+        with self._lock:
+            self.in_use -= 1
+            if reusable:
+                self._idle.append((connection, created_at, now))
+            else:
+                self._open -= 1
+                self.discarded += 1
+            self._lock.notify()
+        if not reusable:
+            _close_quietly(connection)
+
+    def close_idle(self):
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+            self._open -= len(idle)
+        for connection, _, _ in idle:
+            self._created_at.pop(id(connection), None)
+            _close_quietly(connection)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self.in_use,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_seconds': self.wait_seconds,
+                'timeouts': self.timeouts,
+                'created': self.created,
+                'discarded': self.discarded,
+            }
+
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        logger.debug('Error closing pooled connection', exc_info=True)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict):
+    """The pool for a database, or None when POOL is unset or SIZE is 0."""
+    options = {**DEFAULTS, **(settings_dict.get('POOL') or {})}
+    if not settings_dict.get('POOL') or not options['SIZE']:
+        return None
+    # Test setup renames databases; never hand out connections to the old one
+    key = (alias, settings_dict.get('NAME'), settings_dict.get('HOST'), settings_dict.get('PORT'))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.pid != os.getpid():
+            # A forked worker must not share its parent's sockets
+            pool = _pools[key] = ConnectionPool(
+                alias,
+                size=options['SIZE'],
+                timeout=options['TIMEOUT'],
+                max_age=options['MAX_AGE'],
+                ping_after=options['PING_AFTER'],
+            )
+        return pool
+
+
+def stats():
+    """Counters of every pool in this worker, keyed by database alias."""
+    with _pools_lock:
+        pools = [pool for pool in _pools.values() if pool.pid == os.getpid()]
+    return {pool.alias: pool.stats() for pool in pools}
+
+
+@atexit.register
+def _close_all():
+    for pool in list(_pools.values()):
+        if pool.pid == os.getpid():
+            pool.close_idle()
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Mix into a backend's DatabaseWrapper (before it) to take connections
+    from the worker's pool instead of opening one per request.
+    """
+
+    # The pool the current connection came from, to return it there
+    checked_out_from = None
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict)
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        try:
+            connection = pool.checkout(partial(super().get_new_connection, conn_params), self.ping)
+        except PoolTimeout as e:
+            # Surfaces as django.db.OperationalError through wrap_database_errors
+            raise self.Database.OperationalError(str(e)) from e
+        self.checked_out_from = pool
+        return connection
+
+    def ping(self, connection):
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+
+    def _close(self):
+        pool, self.checked_out_from = self.checked_out_from, None
+        if pool is None or self.connection is None:
+            return super()._close()
+        # A connection closed mid-transaction or after errors isn't reused
+        reusable = (
+            not self.in_atomic_block
+            and self.get_autocommit() == self.settings_dict['AUTOCOMMIT']
+            and (not self.errors_occurred or self.is_usable())
+        )
+        with self.wrap_database_errors:
+            pool.checkin(self.connection, reusable)
@@ -0,0 +1,135 @@
+"""
+Read-replica routing.
+
+Reads go to a replica only inside a request (or block) that asked for
+one: GraphQL queries and admin changelists. Everything else, every write,
+and every read after a write in the same request, uses the primary.
+Clients that wrote recently carry a short-lived cookie that pins their
+reads to the primary so they always see their own changes.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.urls import Resolver404, resolve
+from django.utils.decorators import sync_and_async_middleware
+
+PRIMARY = 'default'
+PIN_COOKIE = 'db_primary'
+
+
+@dataclass
+class RoutingState:
+    use_replica: bool = False
+    # Set when the client wrote within REPLICA_PIN_SECONDS
+    pinned: bool = False
+    wrote: bool = False
+    # Set once a read was sent to a replica
+    read_replica: bool = False
+
+
+_state = ContextVar('db_routing_state', default=None)
+
+
+def replicas():
+    return [alias for alias in settings.DATABASES if alias != PRIMARY]
+
+
+@contextmanager
+def read_from_replica(enabled=True):
+    """Route reads in the block to a replica, unless the client is pinned."""
+    state = _state.get()
+    token = None
+    if state is None:
+        state = RoutingState()
+        token = _state.set(state)
+    previous = state.use_replica
+    state.use_replica = enabled
+    try:
+        yield state
+    finally:
+        state.use_replica = previous
+        if token is not None:
+            _state.reset(token)
+
+
+def read_replica():
+    """Whether the current block has read anything from a replica."""
+    state = _state.get()
+    return bool(state and state.read_replica)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state and state.use_replica and not (state.pinned or state.wrote):
+            aliases = replicas()
+            if aliases:
+                state.read_replica = True
+                return random.choice(aliases)
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state:
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+def _is_changelist(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return False
+    return match.namespace == 'admin' and match.url_name.endswith('_changelist')
+
+
+def _begin(request):
+    state = RoutingState(
+        use_replica=_is_changelist(request),
+        pinned=PIN_COOKIE in request.COOKIES,
+    )
+    return state, _state.set(state)
+
+
+def _finish(state, token, response):
+    _state.reset(token)
+    if state.wrote:
+        response.set_cookie(
+            PIN_COOKIE, '1',
+            max_age=settings.REPLICA_PIN_SECONDS,
+            httponly=True,
+            samesite='Lax',
+        )
+    return response
+
+
+@sync_and_async_middleware
+def ReplicaRoutingMiddleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            state, token = _begin(request)
+            try:
+                response = await get_response(request)
+            except BaseException:
+                _state.reset(token)
+                raise
+            return _finish(state, token, response)
+    else:
+        def middleware(request):
+            state, token = _begin(request)
+            try:
+                response = get_response(request)
+            except BaseException:
+                _state.reset(token)
+                raise
+            return _finish(state, token, response)
+    return middleware
@@ -17,6 +17,15 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Threads resizing uploaded product images into variants (store.images);
+# 0 resizes inline after the saving transaction commits
+IMAGE_VARIANT_WORKERS = int(os.environ.get('IMAGE_VARIANT_WORKERS', 2))
+
+# Uploads are streamed to temporary files in chunks instead of memory;
+# reading stops once a file passes the limit and the upload is rejected
+FILE_UPLOAD_HANDLERS = ['store.images.LimitedUploadHandler']
+PRODUCT_IMAGE_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -50,11 +59,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.querystats.QueryBudgetMiddleware',
     "debug_toolbar.middleware.DebugToolbarMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
+    'storefront.routers.ReplicaRoutingMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -85,16 +96,97 @@ WSGI_APPLICATION = 'storefront.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# Connections come from a per-worker pool (storefront.db.pool) and go back
+# to it after every request. DB_POOL_SIZE=0 falls back to Django's
+# persistent per-thread connections, kept for DB_CONN_MAX_AGE seconds.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'storefront.db.mysql',
         'NAME': 'storefront',
         'HOST': 'localhost',
         'USER': 'root',
         'PASSWORD': 'sahar123',
+        'CONN_MAX_AGE': 0 if DB_POOL_SIZE else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'POOL': {
+            'SIZE': DB_POOL_SIZE,
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+            'MAX_AGE': int(os.environ.get('DB_POOL_MAX_AGE', 600)),
+            'PING_AFTER': 30,
+        },
+    }
+}
+
+# Read replicas: comma-separated hosts sharing the primary's credentials.
+# GraphQL queries and admin changelists read from them (storefront.routers).
+for number, host in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'TEST': {'MIRROR': 'default'},
     }
+
+DATABASE_ROUTERS = ['storefront.routers.ReplicaRouter']
+
+# Seconds a client keeps reading from the primary after a write
+REPLICA_PIN_SECONDS = 5
+
+# Per-request SQL budget (store.querystats). MODE is 'log' (warn), 'raise'
+# (fail the request; use in tests) or 'off'.
+SQL_QUERY_BUDGET = {
+    'MODE': os.environ.get('SQL_QUERY_BUDGET_MODE', 'log'),
+    'MAX_QUERIES': 50,
+    'MAX_DB_TIME': 1.0,
+    'REPEATED_QUERY_THRESHOLD': 10,
+}
+
+# GraphQL metrics at /metrics (store.metrics). Operation metrics cover every
+# request; this share of operations also times each resolver and, with
+# GRAPHQL_TRACE_FILE set, appends OpenTelemetry spans (OTLP/JSON lines) there.
+GRAPHQL_TRACE_SAMPLE_RATE = float(os.environ.get('GRAPHQL_TRACE_SAMPLE_RATE', 0.1))
+GRAPHQL_TRACE_FILE = os.environ.get('GRAPHQL_TRACE_FILE', '')
+# Bearer token required by /metrics when set
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# The catalog cache holds GraphQL responses for public catalog queries.
+# Point CATALOG_CACHE_URL at a Redis server to share it between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
 }
 
+if os.environ.get('CATALOG_CACHE_URL'):
+    CACHES['catalog'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['CATALOG_CACHE_URL'],
+    }
+
+CATALOG_CACHE_TIMEOUT = 300
+
+# GraphQL query limits: operations nested deeper than the max depth or whose
+# estimated cost (see store/cost.py) exceeds the max cost are rejected
+GRAPHQL_MAX_QUERY_DEPTH = 10
+GRAPHQL_MAX_QUERY_COST = 10000
+GRAPHQL_DEFAULT_LIST_SIZE = 100
+
+# Serve /graphql/ with the async view; storefront/asgi.py turns this on
+GRAPHQL_ASYNC = os.environ.get('GRAPHQL_ASYNC') == '1'
+
+# Cache alias holding automatic persisted queries (sha256 hash -> query)
+PERSISTED_QUERY_CACHE = 'default'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -20,8 +20,7 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.contrib.auth import views as auth_views
 from django.urls import path
-from strawberry.django.views import GraphQLView
-from store.schema import schema
+from store.views import graphql_view, metrics_view
 
 
 
@@ -30,7 +29,8 @@ admin.site.index_title = "Admin"
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('graphql/', GraphQLView.as_view(schema = schema)),
+    path('graphql/', graphql_view),
+    path('metrics', metrics_view),
     
 ]+ debug_toolbar_urls()
 
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
+from django.db.models import Count
 
 class TaggedItemManager(models.Manager):
     def get_tags_for(self, obj_type, obj_id):
@@ -13,8 +14,39 @@ class TaggedItemManager(models.Manager):
             object_id = obj_id
         )
 
+    def get_tags_for_objects(self, obj_type, obj_ids):
+        """Tags of many objects in one query, as {object_id: [tag, ...]}."""
+        tags = {}
+        items = self.get_queryset() \
+            .select_related('tag') \
+            .filter(
+            content_type = ContentType.objects.get_for_model(obj_type),
+            object_id__in = obj_ids
+        ).order_by('tag__label')
+        for item in items:
+            tags.setdefault(item.object_id, []).append(item.tag)
+        return tags
+
+    def object_ids_tagged(self, obj_type, labels, match_all=False):
+        """
+        Ids of objects carrying any (or, with match_all, every) tag in
+        `labels`, as a values queryset usable in `pk__in`.
+        """
+        labels = set(labels)
+        queryset = self.get_queryset().filter(
+            content_type = ContentType.objects.get_for_model(obj_type),
+            # Resolve labels to tag ids first so (tag, content_type, object_id) is used
+            tag__in = Tag.objects.filter(label__in=labels)
+        ).values('object_id')
+        if match_all:
+            queryset = queryset \
+                .annotate(matched=Count('tag__label', distinct=True)) \
+                .filter(matched=len(labels)) \
+                .values('object_id')
+        return queryset
+
 class Tag(models.Model):
-    label = models.CharField(max_length=255)
+    label = models.CharField(max_length=255, db_index=True)
 
     def __str__(self):
         return self.label
@@ -27,4 +59,9 @@ class TaggedItem(models.Model):
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
 
-
+    class Meta:
+        indexes = [
+            # Tags of an object, and objects carrying a tag
+            models.Index(fields=['content_type', 'object_id'], name='taggeditem_object_idx'),
+            models.Index(fields=['tag', 'content_type', 'object_id'], name='taggeditem_tag_object_idx'),
+        ]